@@ -0,0 +1,80 @@
+"""Rebuilding the tree fields of categories from their parents.
+
+``path`` and ``depth`` and the subtree aggregates ``child_count``,
+``descendant_count`` and ``leaf_count`` are derived from ``parent`` and kept
+current by every write (see ``Category.adjust_ancestors``). Loads that bypass
+``Category.save``, or damage done by hand, are repaired by ``rebuild``.
+"""
+
+from django.db import transaction
+
+from categories.models import Category, CycleError
+from categories.signals import category_changed
+
+
+FIELDS = ["path", "depth", "child_count", "descendant_count", "leaf_count"]
+
+
+def compute(parents):
+    """Tree fields of every category, from a mapping of id to parent id.
+
+    One breadth-first pass from the roots gives the paths, and the counts are
+    summed up walking the same order backwards, so the cost is linear.
+    Returns a mapping of id to a tuple of ``FIELDS``.
+    """
+    children = {}
+    for pk, parent_id in parents.items():
+        children.setdefault(parent_id, []).append(pk)
+
+    order = sorted(children.get(None, ()))
+    paths = dict.fromkeys(order, "")
+    i = 0
+    while i < len(order):
+        pk = order[i]
+        prefix = "{}{}/".format(paths[pk], pk)
+        for child in children.get(pk, ()):
+            paths[child] = prefix
+            order.append(child)
+        i += 1
+    if len(order) != len(parents):
+        unreachable = set(parents) - set(paths)
+        raise CycleError(
+            "Categories form a cycle through {}".format(min(unreachable))
+        )
+
+    descendants = {}
+    leaves = {}
+    for pk in reversed(order):
+        below = children.get(pk, ())
+        descendants[pk] = sum(descendants[child] + 1 for child in below)
+        leaves[pk] = sum(leaves[child] for child in below) or 1
+    return {
+        pk: (
+            paths[pk],
+            paths[pk].count("/"),
+            len(children.get(pk, ())),
+            descendants[pk],
+            leaves[pk],
+        )
+        for pk in order
+    }
+
+
+def rebuild(batch_size=1000, fix=True):
+    """Recompute the tree fields of every category.
+
+    Returns the ids of the categories whose stored fields were wrong, and
+    writes the right values unless ``fix`` is false.
+    """
+    with transaction.atomic():
+        rows = list(Category.objects.values_list("id", "parent_id", *FIELDS))
+        stored = {pk: tuple(values) for pk, _, *values in rows}
+        expected = compute({pk: parent_id for pk, parent_id, *_ in rows})
+        wrong = sorted(pk for pk, values in expected.items() if stored[pk] != values)
+        if fix and wrong:
+            categories = [
+                Category(id=pk, **dict(zip(FIELDS, expected[pk]))) for pk in wrong
+            ]
+            Category.objects.bulk_update(categories, FIELDS, batch_size=batch_size)
+            category_changed(sender=Category)
+    return wrong
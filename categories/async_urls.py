@@ -0,0 +1,10 @@
+from django.urls import path
+
+from categories import async_views
+
+urlpatterns = [
+    path("categories/", async_views.category_list),
+    path("categories/<int:pk>/", async_views.category_detail),
+    path("categories/<int:pk>/similar/", async_views.similar_categories),
+    path("categories/<int:pk>/<type>/", async_views.category_tree_listing),
+]
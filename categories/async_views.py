@@ -0,0 +1,125 @@
+"""Async versions of the read endpoints, for deployments served over ASGI.
+
+They return the same JSON as the views in ``categories.views``, but read the
+database with the async ORM so a worker is not tied up while queries run.
+"""
+
+import asyncio
+
+from django.db.models import Q
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import Request
+
+from categories.conditional import async_catalogue_condition
+from categories.models import Category, Similarity
+from categories.pagination import IdCursorPagination
+from categories.serializers import (
+    CategorySerializer,
+    SimilaritySerializer,
+    category_columns,
+    category_fields,
+)
+
+
+def _json(data, status=200):
+    return JsonResponse(
+        data, status=status, safe=False, json_dumps_params={"ensure_ascii": False}
+    )
+
+
+def _not_found():
+    return _json({"detail": "Not found."}, status=404)
+
+
+async def _page(request, queryset, serializer_class, **kwargs):
+    # The paginator reads query parameters through a DRF request
+    request = Request(request)
+    paginator = IdCursorPagination()
+    try:
+        page = await paginator.apaginate_queryset(queryset, request)
+    except APIException as e:
+        # Such as an invalid cursor, DRF's exception handler doesn't run here
+        return _json(e.detail, status=e.status_code)
+    context = {"request": request}
+    if page is None:
+        rows = [row async for row in queryset.order_by("id")]
+        return _json(serializer_class(rows, many=True, context=context, **kwargs).data)
+    data = serializer_class(page, many=True, context=context, **kwargs).data
+    return _json(
+        {
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+            "results": data,
+        }
+    )
+
+
+async def _category_page(request, queryset):
+    """Page of categories with the fields picked by ``?fields=``/``?exclude=``."""
+    try:
+        fields = category_fields(request.GET)
+    except ValidationError as e:
+        return _json(e.detail, status=400)
+    queryset = queryset.only(*category_columns(fields))
+    return await _page(request, queryset, CategorySerializer, fields=fields)
+
+
+@async_catalogue_condition("category")
+async def category_list(request):
+    return await _category_page(request, Category.objects.all())
+
+
+@async_catalogue_condition("category")
+async def category_detail(request, pk):
+    try:
+        fields = category_fields(request.GET)
+    except ValidationError as e:
+        return _json(e.detail, status=400)
+    try:
+        category = await Category.objects.only(*category_columns(fields)).aget(pk=pk)
+    except Category.DoesNotExist:
+        return _not_found()
+    serializer = CategorySerializer(
+        category, context={"request": request}, fields=fields
+    )
+    return _json(serializer.data)
+
+
+@async_catalogue_condition("category")
+async def category_tree_listing(request, pk, type):
+    if type == "subcategories":
+        # The category check and the page do not depend on each other
+        exists, response = await asyncio.gather(
+            Category.objects.filter(pk=pk).aexists(),
+            _category_page(request, Category.objects.filter(parent_id=pk)),
+        )
+        return response if exists else _not_found()
+    if type not in ("siblings", "leaves", "descendants"):
+        return _json(
+            {
+                "Invalid search type": "{} is not a valid search type option".format(
+                    type
+                )
+            },
+            status=400,
+        )
+
+    try:
+        category = await Category.objects.only("parent", "path").aget(pk=pk)
+    except Category.DoesNotExist:
+        return _not_found()
+    if type == "siblings":
+        queryset = Category.objects.filter(parent_id=category.parent_id)
+    elif type == "leaves":
+        queryset = category.leaves()
+    else:
+        queryset = category.descendants(include_self=True)
+    return await _category_page(request, queryset)
+
+
+@async_catalogue_condition("similarity")
+async def similar_categories(request, pk):
+    # Like the sync view, an unknown category just has no similarities
+    similarities = Similarity.objects.filter(Q(first_id=pk) | Q(second_id=pk))
+    return await _page(request, similarities, SimilaritySerializer)
@@ -0,0 +1,225 @@
+from django.db import connections, transaction
+from django.db.models import Q
+
+from categories import images, islands
+from categories.models import Category, CycleError, Similarity
+from categories.signals import category_changed, similarity_changed
+
+
+def _levels(items, positions):
+    """Group item positions by their depth within the batch.
+
+    Items without a ``parent_key`` form level 0. Raises ``CycleError`` when
+    ``parent_key`` references loop back on themselves.
+    """
+    level = [None] * len(items)
+    for start in range(len(items)):
+        chain = []
+        in_chain = set()
+        current = start
+        while level[current] is None:
+            if current in in_chain:
+                raise CycleError(
+                    "parent_key references form a cycle through {}".format(
+                        items[current]["key"]
+                    )
+                )
+            chain.append(current)
+            in_chain.add(current)
+            parent_key = items[current].get("parent_key")
+            if parent_key is None:
+                break
+            current = positions[parent_key]
+        base = -1 if level[current] is None else level[current]
+        for offset, position in enumerate(reversed(chain)):
+            level[position] = base + offset + 1
+
+    levels = [[] for _ in range(max(level, default=-1) + 1)]
+    for position, depth in enumerate(level):
+        levels[depth].append(position)
+    return levels
+
+
+def _aggregates(items, positions, levels):
+    """Child, descendant and leaf counts of every item of a batch.
+
+    New categories only have descendants within the batch, so the counts are
+    summed up level by level from the deepest one.
+    """
+    children = [[] for _ in items]
+    for position, item in enumerate(items):
+        if "parent_key" in item:
+            children[positions[item["parent_key"]]].append(position)
+    descendants = [0] * len(items)
+    leaves = [1] * len(items)
+    for level in reversed(levels):
+        for position in level:
+            if children[position]:
+                descendants[position] = sum(
+                    descendants[child] + 1 for child in children[position]
+                )
+                leaves[position] = sum(leaves[child] for child in children[position])
+    return [len(c) for c in children], descendants, leaves
+
+
+def create_categories(items, batch_size=1000):
+    """Insert validated ``BulkCategorySerializer`` items in one transaction.
+
+    Each level of the batch is inserted with ``bulk_create`` once the ids of
+    its parents are known. Existing parents get their subtree aggregates
+    updated once for all the categories added below them. Returns the new id
+    of every item that has a key.
+    """
+    positions = {item["key"]: i for i, item in enumerate(items) if "key" in item}
+    levels = _levels(items, positions)
+    child_counts, descendants, leaves = _aggregates(items, positions, levels)
+    parents = {item["parent"] for item in items if item.get("parent")}
+
+    created = [None] * len(items)
+    with transaction.atomic():
+        # Read in the transaction, a parent moved meanwhile has a new path
+        prefixes = {
+            pk: "{}{}/".format(path, pk)
+            for pk, path in Category.objects.filter(id__in=parents).values_list(
+                "id", "path"
+            )
+        }
+        for level in levels:
+            categories = []
+            for position in level:
+                item = items[position]
+                if "parent_key" in item:
+                    parent = created[positions[item["parent_key"]]]
+                    parent_id, path = parent.pk, parent.subtree_prefix
+                else:
+                    parent_id = item.get("parent")
+                    path = prefixes[parent_id] if parent_id else ""
+                categories.append(
+                    Category(
+                        name=item["name"],
+                        description=item["description"],
+                        parent_id=parent_id,
+                        path=path,
+                        depth=path.count("/"),
+                        child_count=child_counts[position],
+                        descendant_count=descendants[position],
+                        leaf_count=leaves[position],
+                    )
+                )
+            categories = Category.objects.bulk_create(categories, batch_size=batch_size)
+            for position, category in zip(level, categories):
+                created[position] = category
+
+        # (size, leaves, children) added below each existing parent
+        attached = {}
+        for position, item in enumerate(items):
+            if item.get("parent"):
+                size, leaf_count, count = attached.get(item["parent"], (0, 0, 0))
+                attached[item["parent"]] = (
+                    size + descendants[position] + 1,
+                    leaf_count + leaves[position],
+                    count + 1,
+                )
+        for parent_id, (size, leaf_count, count) in attached.items():
+            Category.adjust_ancestors(prefixes[parent_id], size, leaf_count, count)
+        # bulk_create does not send post_save
+        category_changed(sender=Category)
+
+    return {
+        item["key"]: category.pk
+        for item, category in zip(items, created)
+        if "key" in item
+    }
+
+
+def update_categories(items, batch_size=1000):
+    """Apply validated ``BulkCategoryUpdateSerializer`` items in one transaction.
+
+    Plain fields are written with ``bulk_update``. Parent changes go through
+    ``Category.save`` one by one, since each rewrites the path of a subtree.
+    """
+    with transaction.atomic():
+        categories = Category.objects.in_bulk([item["id"] for item in items])
+        fields = set()
+        moves = []
+        for item in items:
+            category = categories[item["id"]]
+            for field in ("name", "description"):
+                if field in item:
+                    setattr(category, field, item[field])
+                    fields.add(field)
+            if "parent" in item and item["parent"] != category.parent_id:
+                moves.append((category, item["parent"]))
+        if fields:
+            Category.objects.bulk_update(
+                list(categories.values()), sorted(fields), batch_size=batch_size
+            )
+        for category, parent_id in moves:
+            # An earlier move may have rewritten this category's path
+            category.refresh_from_db(fields=["path", "depth"])
+            category.parent_id = parent_id
+            category.save()
+        category_changed(sender=Category)
+    return list(categories.values())
+
+
+def _delete_rows(queryset):
+    """Delete the rows of ``queryset`` with a single DELETE statement.
+
+    Sends no signals and doesn't cascade. Returns the number of rows.
+    """
+    connection = connections[queryset.db]
+    meta = queryset.model._meta
+    ids, params = queryset.order_by().values(meta.pk.attname).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {} WHERE {} IN ({})".format(
+                connection.ops.quote_name(meta.db_table),
+                connection.ops.quote_name(meta.pk.column),
+                ids,
+            ),
+            params,
+        )
+        return cursor.rowcount
+
+
+def delete_subtree(category):
+    """Delete a category, all of its descendants and their similarities.
+
+    The subtree is found with one query on the path index and removed with
+    set-based deletes in one transaction, instead of by the collector of
+    ``on_delete=CASCADE``, which loads the tree level by level. Image files
+    no longer used by any category are deleted by the image workers after
+    the commit. Returns the number of deleted categories.
+    """
+    with transaction.atomic():
+        # The stored path is authoritative, the instance may be stale
+        category.refresh_from_db(fields=["path"])
+        subtree = category.descendants(include_self=True)
+        rows = list(
+            subtree.values_list(
+                "image", "image_hash", "image_variants", "island", "child_count"
+            )
+        )
+        stored = [
+            (image, digest, variants) for image, digest, variants, *_ in rows if image
+        ]
+        labels = {row[3] for row in rows if row[3] is not None}
+        leaves = sum(1 for row in rows if row[4] == 0)
+
+        # Neither query sends post_delete, the receivers are called below
+        similarities = Similarity.objects.filter(
+            Q(first_id__in=subtree.values("id")) | Q(second_id__in=subtree.values("id"))
+        )
+        removed_similarities = _delete_rows(similarities)
+        _delete_rows(subtree)
+        Category.adjust_ancestors(category.path, -len(rows), -leaves, -1)
+
+        for label in labels:
+            islands.recompute(label)
+        category_changed(sender=Category)
+        if removed_similarities:
+            similarity_changed(sender=Similarity)
+        if stored:
+            transaction.on_commit(lambda: images.submit(images.delete_unused, stored))
+    return len(rows)
@@ -0,0 +1,63 @@
+import hashlib
+from functools import wraps
+
+from django.views.decorators.http import condition
+
+from categories.models import Version
+
+
+def _versions(request, names):
+    # etag_func and last_modified_func are called separately, read once
+    if not hasattr(request, "catalogue_versions"):
+        request.catalogue_versions = Version.snapshot(names)
+    return request.catalogue_versions
+
+
+def catalogue_condition(*names, encoding=None):
+    """Conditional GET driven by the version counters of ``names``.
+
+    The ETag covers the counters, the full path and the Accept header, so any
+    write to those parts of the catalogue, or a different page, format or
+    query, yields a new one. Answering 304 costs a single query.
+
+    Views that compress their response themselves pass ``encoding``, which
+    returns the content encoding chosen for a request, so that the gzipped
+    and plain bodies get different ETags.
+    """
+
+    def etag(request, *args, **kwargs):
+        versions = _versions(request, names)
+        parts = [request.get_full_path(), request.META.get("HTTP_ACCEPT", "")]
+        if encoding is not None:
+            parts.append(encoding(request))
+        key = "|".join(
+            parts + ["{}={}".format(name, versions[name][0]) for name in names]
+        )
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        versions = _versions(request, names)
+        timestamps = [updated_at for _, updated_at in versions.values() if updated_at]
+        return max(timestamps, default=None)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def async_catalogue_condition(*names):
+    """``catalogue_condition`` for async views.
+
+    The version counters are read with the async ORM up front, so the
+    synchronous ETag and Last-Modified callbacks find them on the request.
+    """
+
+    def decorator(view):
+        conditional_view = catalogue_condition(*names)(view)
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            request.catalogue_versions = await Version.asnapshot(names)
+            return await conditional_view(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
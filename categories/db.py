@@ -0,0 +1,24 @@
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+_PRAGMA_VALUE = re.compile(r"-?\w+")
+
+
+def configure_sqlite(connection):
+    """Run the ``CATEGORIES_SQLITE_PRAGMAS`` on a new SQLite connection.
+
+    Called from ``connection_created``, before the connection is used. PRAGMA
+    values can't be query parameters, so they are checked to be single words
+    or integers.
+    """
+    for name, value in settings.CATEGORIES_SQLITE_PRAGMAS.items():
+        value = str(value)
+        if not name.isidentifier() or not _PRAGMA_VALUE.fullmatch(value):
+            raise ImproperlyConfigured(
+                "Invalid SQLite pragma {} = {!r}".format(name, value)
+            )
+        # Like Django's own pragmas, run on the database connection directly
+        connection.connection.execute("PRAGMA {} = {}".format(name, value))
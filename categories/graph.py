@@ -0,0 +1,210 @@
+from array import array
+from collections import deque
+
+from categories.models import Category, Similarity
+
+
+class Graph:
+    """Undirected graph stored as compressed sparse row (CSR) arrays.
+
+    Vertices are addressed by their position in ``ids``; ``neighbours(i)``
+    yields positions as well. Neighbours keep the order of the edge list.
+    """
+
+    def __init__(self, ids, edges):
+        self.ids = array("q", ids)
+        self.index = {pk: i for i, pk in enumerate(self.ids)}
+        n = len(self.ids)
+
+        sources = array("q")
+        targets = array("q")
+        for first, second in edges:
+            sources.append(self.index[first])
+            targets.append(self.index[second])
+
+        degree = array("q", bytes(8 * (n + 1)))
+        for i in range(len(sources)):
+            degree[sources[i] + 1] += 1
+            degree[targets[i] + 1] += 1
+        for i in range(n):
+            degree[i + 1] += degree[i]
+        self.indptr = degree
+
+        fill = array("q", degree[:n])
+        self.indices = array("q", bytes(8 * degree[n]))
+        for i in range(len(sources)):
+            a, b = sources[i], targets[i]
+            self.indices[fill[a]] = b
+            fill[a] += 1
+            self.indices[fill[b]] = a
+            fill[b] += 1
+
+    @classmethod
+    def from_database(cls):
+        ids = Category.objects.order_by("id").values_list("id", flat=True)
+        edges = Similarity.objects.order_by("id").values_list("first_id", "second_id")
+        return cls(ids, edges.iterator(chunk_size=10000))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Graph of all categories on the arrays of a ``categories.snapshot``.
+
+        Like ``from_database`` but nothing is read or built, and pickling it
+        for a worker process passes the path of the snapshot.
+        """
+        graph = cls.__new__(cls)
+        graph.snapshot = snapshot
+        graph.ids = snapshot.ids
+        graph.index = snapshot.index
+        graph.indptr = snapshot.indptr
+        graph.indices = snapshot.indices
+        return graph
+
+    def __reduce_ex__(self, protocol):
+        if getattr(self, "snapshot", None) is not None:
+            return (Graph.from_snapshot, (self.snapshot,))
+        return super().__reduce_ex__(protocol)
+
+    @classmethod
+    def from_similarities(cls):
+        """Graph of the categories that have at least one similarity."""
+        edges = list(Similarity.objects.values_list("first_id", "second_id"))
+        ids = sorted({pk for edge in edges for pk in edge})
+        return cls(ids, edges)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def neighbours(self, vertex):
+        return self.indices[self.indptr[vertex] : self.indptr[vertex + 1]]
+
+    def components(self):
+        """Return every connected component as a sorted list of positions."""
+        seen = bytearray(len(self))
+        result = []
+        for start in range(len(self)):
+            if seen[start]:
+                continue
+            seen[start] = 1
+            component = [start]
+            queue = deque(component)
+            while queue:
+                for neighbour in self.neighbours(queue.popleft()):
+                    if not seen[neighbour]:
+                        seen[neighbour] = 1
+                        component.append(neighbour)
+                        queue.append(neighbour)
+            component.sort()
+            result.append(component)
+        return result
+
+    def farthest_path(self, start):
+        """Return the shortest path from the vertex farthest from ``start``.
+
+        The path is given as positions, starting at the far end. Among equally
+        far vertices the first one discovered wins.
+        """
+        parents = {start: None}
+        distances = {start: 0}
+        queue = deque([start])
+        far = start
+        while queue:
+            current = queue.popleft()
+            for neighbour in self.neighbours(current):
+                if neighbour not in parents:
+                    parents[neighbour] = current
+                    distances[neighbour] = distances[current] + 1
+                    if distances[neighbour] > distances[far]:
+                        far = neighbour
+                    queue.append(neighbour)
+
+        path = []
+        while far is not None:
+            path.append(far)
+            far = parents[far]
+        return path
+
+    def longest_path(self, component, exact=True):
+        """Return the longest shortest path inside ``component``.
+
+        The exact search runs a BFS from every vertex of the component. The
+        approximate one is a double sweep: two BFS runs, exact on trees and a
+        lower bound on general graphs.
+        """
+        if len(component) == 1:
+            return [component[0]]
+        if not exact:
+            far = self.farthest_path(component[0])[0]
+            return self.farthest_path(far)
+
+        longest = []
+        for vertex in component:
+            path = self.farthest_path(vertex)
+            if len(path) > len(longest):
+                longest = path
+        return longest
+
+    def within(self, start, depth):
+        """Return the distance of every vertex at most ``depth`` hops away.
+
+        ``start`` itself is left out.
+        """
+        distances = {start: 0}
+        frontier = [start]
+        for distance in range(1, depth + 1):
+            following = []
+            for vertex in frontier:
+                for neighbour in self.neighbours(vertex):
+                    if neighbour not in distances:
+                        distances[neighbour] = distance
+                        following.append(neighbour)
+            if not following:
+                break
+            frontier = following
+        del distances[start]
+        return distances
+
+    def shortest_path(self, source, target):
+        """Return a shortest path from ``source`` to ``target``, or None.
+
+        Runs a BFS from both ends, always growing the smaller frontier by a
+        whole level, until the two searches meet.
+        """
+        if source == target:
+            return [source]
+        parents = ({source: None}, {target: None})
+        frontiers = ([source], [target])
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            mine, other = parents[side], parents[1 - side]
+            following = []
+            meetings = []
+            for vertex in frontiers[side]:
+                for neighbour in self.neighbours(vertex):
+                    if neighbour in mine:
+                        continue
+                    mine[neighbour] = vertex
+                    following.append(neighbour)
+                    if neighbour in other:
+                        meetings.append(neighbour)
+            if meetings:
+                # Vertices seen from the other end may lie on different levels
+                meeting = min(meetings, key=lambda v: self._depth(other, v))
+                path = self._walk(parents[0], meeting)[::-1]
+                return path + self._walk(parents[1], meeting)[1:]
+            frontiers = (
+                (following, frontiers[1]) if side == 0 else (frontiers[0], following)
+            )
+        return None
+
+    @staticmethod
+    def _walk(parents, vertex):
+        path = []
+        while vertex is not None:
+            path.append(vertex)
+            vertex = parents[vertex]
+        return path
+
+    @classmethod
+    def _depth(cls, parents, vertex):
+        return len(cls._walk(parents, vertex))
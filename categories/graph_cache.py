@@ -0,0 +1,27 @@
+from categories.graph import Graph
+from categories.models import Version
+
+
+_cached = None
+
+
+def get_graph(version=None):
+    """Return the similarity graph matching the current similarity version.
+
+    Like ``tree_cache.get_snapshot``, the graph is rebuilt only after a
+    similarity has changed. Categories without similarities are not part of
+    it.
+    """
+    global _cached
+    if version is None:
+        version = Version.current("similarity")
+    cached = _cached
+    if cached is None or cached[0] != version:
+        cached = (version, Graph.from_similarities())
+        _cached = cached
+    return cached[1]
+
+
+def invalidate():
+    global _cached
+    _cached = None
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections
+from PIL import Image
+
+from categories.models import Category
+from categories.signals import category_changed
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {"jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+
+_executor = None
+
+
+def _storage():
+    return Category.image.field.storage
+
+
+def submit(task, *args):
+    """Run ``task`` on the image worker pool.
+
+    With ``CATEGORIES_IMAGE_WORKERS = 0`` the task runs right away in the
+    calling thread instead.
+    """
+    global _executor
+    if not settings.CATEGORIES_IMAGE_WORKERS:
+        return task(*args)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.CATEGORIES_IMAGE_WORKERS,
+            thread_name_prefix="category-images",
+        )
+    _executor.submit(_run, task, args)
+
+
+def _run(task, args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception("Image task %s failed", task.__name__)
+    finally:
+        connections.close_all()
+
+
+def is_image(upload):
+    """Whether Pillow recognises ``upload`` as an image.
+
+    Reads only what ``Image.verify`` needs, without decoding the pixels.
+    """
+    try:
+        with Image.open(upload) as image:
+            image.verify()
+    except Exception:
+        # Pillow raises many different types for files it can't read
+        return False
+    finally:
+        upload.seek(0)
+    return True
+
+
+def store_upload(upload):
+    """Save an uploaded image under the hash of its content.
+
+    Reads the upload chunk by chunk. Identical images share a single stored
+    file. Returns the stored name and the hash.
+    """
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+
+    extension = os.path.splitext(upload.name)[1].lower()
+    name = "images/{}/{}{}".format(digest[:2], digest, extension)
+    storage = _storage()
+    if not storage.exists(name):
+        name = storage.save(name, upload)
+    return name, digest
+
+
+def generate_variants(category_id, name, digest):
+    """Write resized JPEG and WebP copies of an image and record them.
+
+    Variants are stored by image hash, so they are only generated once for
+    images shared by several categories.
+    """
+    storage = _storage()
+    variants = {}
+    with storage.open(name) as f, Image.open(f) as image:
+        image.load()
+        for label, size in settings.CATEGORIES_IMAGE_SIZES.items():
+            resized = None
+            variants[label] = {}
+            for key, (image_format, extension) in VARIANT_FORMATS.items():
+                variant = "images/variants/{}/{}.{}".format(digest, label, extension)
+                if not storage.exists(variant):
+                    if resized is None:
+                        resized = image.convert("RGB")
+                        resized.thumbnail((size, size))
+                    buffer = BytesIO()
+                    resized.save(buffer, image_format)
+                    variant = storage.save(variant, ContentFile(buffer.getvalue()))
+                variants[label][key] = variant
+
+    # The image may have been replaced while the variants were generated
+    updated = Category.objects.filter(pk=category_id, image=name).update(
+        image_variants=variants
+    )
+    if updated:
+        category_changed(sender=Category)
+
+
+def delete_files(names):
+    storage = _storage()
+    for name in names:
+        storage.delete(name)
+
+
+def delete_unused(images):
+    """Delete images left behind by deleted categories.
+
+    ``images`` holds the stored name, hash and variants of each image. As
+    uploads are shared by content, a file is only deleted when no category
+    refers to it anymore, and variants when no category has the same hash.
+    """
+    unused = []
+    for name, digest, variants in images:
+        if not Category.objects.filter(image=name).exists():
+            unused.append(name)
+        if variants and not Category.objects.filter(image_hash=digest).exists():
+            unused.extend(
+                variant for formats in variants.values() for variant in formats.values()
+            )
+    delete_files(unused)
@@ -0,0 +1,102 @@
+"""Rabbit islands, the connected components of the similarity graph.
+
+Every category in an island of two or more stores the island's label in
+``Category.island``. The label is the id of one of the island's categories,
+so labels never collide. Categories without similarities are islands of
+their own and store null.
+"""
+
+from django.db import transaction
+from django.db.models import Count
+
+from categories.graph import Graph
+from categories.models import Category, Similarity
+
+
+def label_of(pk):
+    """Label of the island of category ``pk``; its own id when it is alone."""
+    island = Category.objects.filter(pk=pk).values_list("island", flat=True).get()
+    return pk if island is None else island
+
+
+def size_of(label):
+    return Category.objects.filter(island=label).count() or 1
+
+
+def merge(first, second):
+    """Join the islands of two categories that just became similar.
+
+    The smaller island takes the label of the larger one, so the fewest rows
+    are rewritten.
+    """
+    with transaction.atomic(savepoint=False):
+        labels = dict(
+            Category.objects.filter(pk__in=[first, second]).values_list("id", "island")
+        )
+        first_label, second_label = labels[first], labels[second]
+        if first_label is None and second_label is None:
+            Category.objects.filter(pk__in=[first, second]).update(
+                island=min(first, second)
+            )
+        elif first_label is None:
+            Category.objects.filter(pk=first).update(island=second_label)
+        elif second_label is None:
+            Category.objects.filter(pk=second).update(island=first_label)
+        elif first_label != second_label:
+            sizes = dict(
+                Category.objects.filter(island__in=[first_label, second_label])
+                .values_list("island")
+                .annotate(size=Count("id"))
+            )
+            smaller, larger = sorted(
+                [first_label, second_label], key=lambda label: (sizes[label], label)
+            )
+            Category.objects.filter(island=smaller).update(island=larger)
+
+
+def split(pk):
+    """Recompute the island of ``pk`` after one of its similarities was removed."""
+    with transaction.atomic(savepoint=False):
+        label = (
+            Category.objects.filter(pk=pk).values_list("island", flat=True).first()
+        )
+        if label is not None:
+            recompute(label)
+
+
+def recompute(label):
+    """Relabel what is left of island ``label`` after parts were removed.
+
+    Only the categories and similarities of that island are read. The part
+    holding the category the label comes from keeps it, every other part is
+    labelled with its smallest id.
+    """
+    with transaction.atomic(savepoint=False):
+        members = Category.objects.filter(island=label).order_by("id")
+        # Both ends of a similarity are always in the same island
+        edges = Similarity.objects.filter(first__island=label).values_list(
+            "first_id", "second_id"
+        )
+        graph = Graph(members.values_list("id", flat=True), edges)
+        alone = []
+        for component in graph.components():
+            ids = [graph.ids[i] for i in component]
+            if len(ids) == 1:
+                alone.extend(ids)
+            elif label not in ids:
+                Category.objects.filter(id__in=ids).update(island=ids[0])
+        Category.objects.filter(id__in=alone).update(island=None)
+
+
+def rebuild(batch_size=1000):
+    """Label every island from scratch, for bulk loads."""
+    graph = Graph.from_similarities()
+    with transaction.atomic():
+        Category.objects.exclude(island=None).update(island=None)
+        categories = []
+        for component in graph.components():
+            label = graph.ids[component[0]]
+            categories.extend(
+                Category(id=graph.ids[i], island=label) for i in component
+            )
+        Category.objects.bulk_update(categories, ["island"], batch_size=batch_size)
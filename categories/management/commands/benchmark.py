@@ -0,0 +1,516 @@
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core import management
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from categories import aggregates, islands, snapshot
+from categories.models import Category, Similarity
+from categories.signals import category_changed, similarity_changed
+
+
+SHAPES = ("chain", "wide", "balanced")
+GRAPHS = {"sparse": 1, "dense": 10}  # similarities per category
+
+# Read endpoints from categories/urls.py. {id} is filled in with a random
+# category per request, {other} with one on the same island and {ids} with
+# LOOKUP_SIZE of them.
+ENDPOINTS = [
+    "/categories/",
+    "/categories/?page_size=1000",
+    "/categories/?page_size=1000&fields=name,descendant_count,leaf_count",
+    "/categories/?ids={ids}",
+    "/categories/{id}/",
+    "/categories/search/?q={id}",
+    "/categories/search/?q=category+{id}&autocomplete=1",
+    "/categories/{id}/similar/",
+    "/categories/{id}/similar/?depth=2",
+    "/categories/{id}/tree/",
+    "/categories/{id}/subcategories/",
+    "/categories/{id}/siblings/",
+    "/categories/{id}/leaves/",
+    "/categories/{id}/descendants/",
+    "/categories/{id}/island/",
+    "/categories/{id}/path/{other}/",
+    "/similarity/",
+    "/islands/",
+    "/export/",
+]
+
+# Read endpoints taking a POST body, built by batch_queries
+POST_ENDPOINTS = ["/categories/batch/"]
+
+# Categories of one lookup, as shown together on a product page
+LOOKUP_SIZE = 5
+BATCH_TYPES = ["category", "siblings", "similar"]
+
+# Read while similarities are written by --concurrency
+CONCURRENT_ENDPOINTS = [
+    "/categories/{id}/",
+    "/categories/{id}/similar/",
+    "/categories/{id}/subcategories/",
+]
+
+
+def generate_parents(shape, size, depth):
+    """Parent id of categories 1..size; parents always precede children."""
+    if shape == "chain":
+        # Chains of ``depth`` categories hanging from separate roots
+        return [
+            None if (pk - 1) % depth == 0 else pk - 1 for pk in range(1, size + 1)
+        ]
+    if shape == "wide":
+        return [None] + [1] * (size - 1)
+    # Balanced tree where every category has four children
+    return [None] + [(pk - 2) // 4 + 1 for pk in range(2, size + 1)]
+
+
+def generate_edges(size, per_category, rng):
+    edges = set()
+    target = min(size * per_category, size * (size - 1) // 2)
+    while len(edges) < target:
+        first, second = rng.randint(1, size), rng.randint(1, size)
+        if first != second:
+            edges.add(Similarity.canonical(first, second))
+    return sorted(edges)
+
+
+def batch_queries(ids):
+    """Body of a ``/categories/batch/`` request for a product page of ``ids``."""
+    return [{"id": pk, "type": query_type} for pk in ids for query_type in BATCH_TYPES]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _read_until(seed, size, begin, end):
+    """Read random endpoints from ``begin`` to ``end``, in a worker process."""
+    client = Client(raise_request_exception=False)
+    rng = random.Random(seed)
+    latencies = []
+    queries = []
+    errors = 0
+    executed = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal executed
+        executed += 1
+        return execute(sql, params, many, context)
+
+    time.sleep(max(0, begin - time.time()))
+    try:
+        with connection.execute_wrapper(count):
+            while time.time() < end:
+                endpoint = rng.choice(CONCURRENT_ENDPOINTS)
+                url = endpoint.format(id=rng.randint(1, size))
+                before = executed
+                started = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - started)
+                queries.append(executed - before)
+                if response.status_code != 200:
+                    errors += 1
+    finally:
+        connection.close()
+    return latencies, queries, errors
+
+
+def _write_until(seed, size, begin, end):
+    """POST random similarities from ``begin`` to ``end``, in a worker process."""
+    client = Client(raise_request_exception=False)
+    rng = random.Random(seed)
+    writes = 0
+    errors = 0
+    time.sleep(max(0, begin - time.time()))
+    try:
+        while time.time() < end:
+            first, second = rng.sample(range(1, size + 1), 2)
+            response = client.post("/similarity/", {"first": first, "second": second})
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                writes += 1
+    finally:
+        connection.close()
+    return writes, errors
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API endpoints and rabbit_hole on synthetic catalogues"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--size", type=int, default=10000)
+        parser.add_argument("--depth", type=int, default=50, help="Length of chains")
+        parser.add_argument("--shape", nargs="+", choices=SHAPES, default=SHAPES)
+        parser.add_argument(
+            "--graph", nargs="+", choices=list(GRAPHS), default=list(GRAPHS)
+        )
+        parser.add_argument(
+            "--requests", type=int, default=20, help="Timed requests per endpoint"
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--baseline", help="Compare with an earlier --output")
+        parser.add_argument(
+            "--exact-rabbit-hole",
+            action="store_true",
+            help="Also time the exact rabbit_hole search, which is quadratic",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=0,
+            help=(
+                "Also measure the read throughput of this many processes while "
+                "another one writes similarities, for each SQLite journal mode"
+            ),
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=3,
+            help="Seconds each --concurrency run lasts",
+        )
+        parser.add_argument(
+            "--in-transaction",
+            action="store_true",
+            help=(
+                "Generate into the configured database inside a transaction "
+                "that is rolled back, instead of a scratch database"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["size"] < 2 or options["depth"] < 1 or options["requests"] < 1:
+            raise CommandError("--size, --depth and --requests are too small")
+        if options["concurrency"] and options["in_transaction"]:
+            raise CommandError(
+                "--concurrency needs committed data, it can't run --in-transaction"
+            )
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        # Requests are made with the test client, which uses this host
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            if options["in_transaction"]:
+                with transaction.atomic():
+                    results = self._run(options)
+                    transaction.set_rollback(True)
+            else:
+                results = self._with_scratch_database(options)
+
+        report = {
+            "meta": {
+                "seed": options["seed"],
+                "size": options["size"],
+                "depth": options["depth"],
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        if baseline:
+            self._compare(baseline, results)
+
+    def _with_scratch_database(self, options):
+        handle, name = tempfile.mkstemp(suffix=".sqlite3", prefix="benchmark_")
+        os.close(handle)
+        old_name = connection.settings_dict["NAME"]
+        test_settings = connection.settings_dict.setdefault("TEST", {})
+        old_test_name = test_settings.get("NAME")
+        test_settings["NAME"] = name
+        try:
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            return self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings["NAME"] = old_test_name
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def _run(self, options):
+        results = []
+        for shape in options["shape"]:
+            for graph in options["graph"]:
+                dataset = "{}/{}".format(shape, graph)
+                rng = random.Random("{}/{}".format(options["seed"], dataset))
+                self._generate(shape, graph, options, rng)
+                for endpoint in ENDPOINTS:
+                    results.append(self._endpoint(dataset, endpoint, options, rng))
+                for endpoint in POST_ENDPOINTS:
+                    results.append(
+                        self._endpoint(dataset, endpoint, options, rng, method="POST")
+                    )
+                results.extend(self._rabbit_hole(dataset, options))
+                if options["concurrency"]:
+                    results.extend(self._concurrent(dataset, options))
+        return results
+
+    def _generate(self, shape, graph, options, rng):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(Similarity._meta.db_table))
+            cursor.execute("DELETE FROM {}".format(Category._meta.db_table))
+
+        size = options["size"]
+        parents = generate_parents(shape, size, options["depth"])
+        prefixes = {}
+        batch = []
+        for pk, parent in enumerate(parents, start=1):
+            path = prefixes[parent] if parent else ""
+            if shape != "wide" or pk == 1:
+                prefixes[pk] = "{}{}/".format(path, pk)
+            batch.append(
+                Category(
+                    id=pk,
+                    name="category {}".format(pk),
+                    description="synthetic {} category {}".format(shape, pk),
+                    parent_id=parent,
+                    path=path,
+                    depth=path.count("/"),
+                )
+            )
+        Category.objects.bulk_create(batch, batch_size=2000)
+        Similarity.objects.bulk_create(
+            [
+                Similarity(first_id=first, second_id=second)
+                for first, second in generate_edges(size, GRAPHS[graph], rng)
+            ],
+            batch_size=2000,
+        )
+        aggregates.rebuild()
+        islands.rebuild()
+        category_changed(sender=Category)
+        similarity_changed(sender=Similarity)
+
+    def _measure(self, dataset, target, run, count):
+        """Time ``run`` ``count`` times, then once more to trace memory."""
+        run()  # warm up caches
+        latencies = []
+        queries = []
+        rows = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                rows += run()
+                latencies.append(time.perf_counter() - request_started)
+            queries.append(len(captured))
+        wall_time = time.perf_counter() - started
+
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result = {
+            "dataset": dataset,
+            "target": target,
+            "requests": count,
+            "wall_time": wall_time,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "queries_mean": sum(queries) / count,
+            "queries_max": max(queries),
+            "peak_memory_kb": peak / 1024,
+            "rows_per_second": rows / wall_time if wall_time else 0,
+        }
+        self.stdout.write(
+            "{dataset:16} {target:40} p50 {p50_ms:8.2f}ms p95 {p95_ms:8.2f}ms "
+            "p99 {p99_ms:8.2f}ms {queries_mean:7.1f} queries "
+            "{peak_memory_kb:9.0f}KiB".format(**result)
+        )
+        return result
+
+    def _endpoint(self, dataset, endpoint, options, rng, method="GET"):
+        client = Client()
+        ids = [rng.randint(1, options["size"]) for _ in range(options["requests"])]
+        ids.append(1)
+        others = self._same_island(ids, rng) if "{other}" in endpoint else ids
+        position = iter(range(len(ids) * 3))
+
+        def run():
+            start = next(position) % len(ids)
+            picked = [ids[(start + i) % len(ids)] for i in range(LOOKUP_SIZE)]
+            if method == "POST":
+                url = endpoint
+                response = client.post(
+                    url, batch_queries(picked), content_type="application/json"
+                )
+            else:
+                url = endpoint.format(
+                    id=picked[0], other=others[start], ids=",".join(map(str, picked))
+                )
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(
+                    "{} {} returned {}".format(method, url, response.status_code)
+                )
+            if response.streaming:
+                return sum(chunk.count(b"\n") for chunk in response.streaming_content)
+            data = json.loads(response.content)
+            if isinstance(data, dict) and "results" in data:
+                # Batch answers each hold a list of categories
+                return sum(
+                    len(result["results"])
+                    if isinstance(result, dict) and "results" in result
+                    else 1
+                    for result in data["results"]
+                )
+            if isinstance(data, dict) and "path" in data:
+                return len(data["path"])
+            return 1
+
+        target = "{} {}".format(method, endpoint)
+        return self._measure(dataset, target, run, options["requests"])
+
+    def _same_island(self, ids, rng):
+        """A random category connected to each of ``ids`` by similarities."""
+        members = {}
+        island_of = {}
+        for pk, island in Category.objects.exclude(island=None).values_list(
+            "id", "island"
+        ):
+            members.setdefault(island, []).append(pk)
+            island_of[pk] = island
+        return [
+            rng.choice(members[island_of[pk]]) if pk in island_of else pk
+            for pk in ids
+        ]
+
+    def _rabbit_hole(self, dataset, options):
+        fd, path = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+        try:
+            snapshot.write(path)
+            return self._rabbit_hole_variants(dataset, options, path)
+        finally:
+            os.remove(path)
+
+    def _rabbit_hole_variants(self, dataset, options, path):
+        variants = [
+            ("rabbit_hole --approximate", ["--approximate"]),
+            (
+                "rabbit_hole --approximate --snapshot",
+                ["--approximate", "--snapshot", path],
+            ),
+        ]
+        if options["exact_rabbit_hole"]:
+            variants.append(("rabbit_hole", []))
+        results = []
+        for target, arguments in variants:
+
+            def run():
+                management.call_command(
+                    "rabbit_hole", "--json", *arguments, stdout=StringIO()
+                )
+                return options["size"]
+
+            results.append(self._measure(dataset, target, run, 3))
+        return results
+
+    def _concurrent(self, dataset, options):
+        """Read throughput during writes, in rollback journal and WAL mode."""
+        modes = ["delete", "wal"] if connection.vendor == "sqlite" else [None]
+        results = []
+        for mode in modes:
+            pragmas = dict(settings.CATEGORIES_SQLITE_PRAGMAS)
+            target = "{} readers + 1 writer".format(options["concurrency"])
+            if mode is not None:
+                pragmas["journal_mode"] = mode
+                target += ", journal_mode={}".format(mode)
+            # The journal mode can only change while no other connection is open
+            connections.close_all()
+            with override_settings(CATEGORIES_SQLITE_PRAGMAS=pragmas):
+                connection.ensure_connection()
+                results.append(self._concurrent_run(dataset, target, options))
+            connections.close_all()
+        return results
+
+    def _concurrent_run(self, dataset, target, options):
+        # Processes rather than threads, like the workers of an application
+        # server, so readers are not serialized by the GIL
+        begin = time.time() + 1  # once every process has started
+        end = begin + options["duration"]
+        size = options["size"]
+        readers = options["concurrency"]
+        with ProcessPoolExecutor(max_workers=readers + 1) as pool:
+            writer = pool.submit(_write_until, options["seed"], size, begin, end)
+            reads = [
+                pool.submit(_read_until, options["seed"] + i, size, begin, end)
+                for i in range(readers)
+            ]
+            latencies, queries, errors = [], [], writer.result()[1]
+            for future in reads:
+                read_latencies, read_queries, read_errors = future.result()
+                latencies.extend(read_latencies)
+                queries.extend(read_queries)
+                errors += read_errors
+        wall_time = options["duration"]
+        if not latencies:
+            raise CommandError("No read finished within --duration")
+
+        result = {
+            "dataset": dataset,
+            "target": target,
+            "requests": len(latencies),
+            "wall_time": wall_time,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "queries_mean": sum(queries) / len(queries),
+            "queries_max": max(queries),
+            "reads_per_second": len(latencies) / wall_time,
+            "writes_per_second": writer.result()[0] / wall_time,
+            "errors": errors,
+        }
+        self.stdout.write(
+            "{dataset:16} {target:40} {reads_per_second:7.0f} reads/s "
+            "p95 {p95_ms:8.2f}ms p99 {p99_ms:8.2f}ms "
+            "{writes_per_second:6.0f} writes/s {errors} errors".format(**result)
+        )
+        return result
+
+    def _compare(self, baseline, results):
+        previous = {(r["dataset"], r["target"]): r for r in baseline["results"]}
+        self.stdout.write("\nCompared to baseline (p50, queries):")
+        for result in results:
+            old = previous.get((result["dataset"], result["target"]))
+            if old is None:
+                continue
+            ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 0
+            self.stdout.write(
+                "{:16} {:40} {:6.2f}x  {:7.1f} -> {:7.1f}".format(
+                    result["dataset"],
+                    result["target"],
+                    ratio,
+                    old["queries_mean"],
+                    result["queries_mean"],
+                )
+            )
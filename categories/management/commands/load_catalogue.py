@@ -0,0 +1,174 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from categories import aggregates, islands
+from categories.models import Category, Similarity
+from categories.signals import category_changed, similarity_changed
+
+
+def _read_rows(path, file_format):
+    with open(path, newline="", encoding="utf-8") as f:
+        if file_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+
+class Command(BaseCommand):
+    help = "Load categories and similarities from NDJSON or CSV files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--categories",
+            help="File with one category per row: id, name, description, parent",
+        )
+        parser.add_argument(
+            "--similarities", help="File with one similarity per row: first, second"
+        )
+        parser.add_argument(
+            "--format",
+            choices=["ndjson", "csv"],
+            help="Format of both files, guessed from the extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def _format(self, path, options):
+        if options["format"]:
+            return options["format"]
+        return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+    def _report(self, name, count, started):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write("{}: {} rows, {:.0f} rows/s".format(name, count, rate))
+
+    def _parents(self, path, file_format):
+        """First pass: read only the id and parent of every category."""
+        parents = {}
+        for row in _read_rows(path, file_format):
+            parents[int(row["id"])] = _optional_int(row.get("parent"))
+        return parents
+
+    def _prefix_resolver(self, parents):
+        external = {p for p in parents.values() if p is not None and p not in parents}
+        prefixes = {}
+        external = list(external)
+        for start in range(0, len(external), 500):
+            chunk = external[start : start + 500]
+            for pk, path in Category.objects.filter(id__in=chunk).values_list(
+                "id", "path"
+            ):
+                prefixes[pk] = "{}{}/".format(path, pk)
+        missing = set(external) - set(prefixes)
+        if missing:
+            raise CommandError("Unknown parent category {}".format(min(missing)))
+
+        def prefix(pk):
+            # Walk up to the nearest known prefix, then fill in the chain
+            chain = []
+            while pk not in prefixes:
+                chain.append(pk)
+                if len(chain) > len(parents):
+                    raise CommandError("Categories form a cycle through {}".format(pk))
+                pk = parents[pk]
+                if pk is None:
+                    break
+            path = prefixes[pk] if pk is not None else ""
+            for ancestor in reversed(chain):
+                path = "{}{}/".format(path, ancestor)
+                prefixes[ancestor] = path
+            return path
+
+        return prefix
+
+    def _load_categories(self, path, file_format, batch_size):
+        parents = self._parents(path, file_format)
+        prefix = self._prefix_resolver(parents)
+
+        started = time.perf_counter()
+        count = 0
+        batch = []
+        for row in _read_rows(path, file_format):
+            pk = int(row["id"])
+            parent = parents[pk]
+            category_path = prefix(parent) if parent is not None else ""
+            batch.append(
+                Category(
+                    id=pk,
+                    name=row["name"],
+                    description=row.get("description") or "",
+                    image=row.get("image") or None,
+                    parent_id=parent,
+                    path=category_path,
+                    depth=category_path.count("/"),
+                )
+            )
+            if len(batch) >= batch_size:
+                Category.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+                self._report("categories", count, started)
+        Category.objects.bulk_create(batch)
+        count += len(batch)
+        self._report("categories", count, started)
+
+    def _load_similarities(self, path, file_format, batch_size):
+        started = time.perf_counter()
+        # bulk_create can't tell which rows the unique constraint skipped,
+        # what was inserted is known from the table size at the end
+        before = Similarity.objects.count()
+        read = 0
+        batch = []
+        for row in _read_rows(path, file_format):
+            first, second = Similarity.canonical(int(row["first"]), int(row["second"]))
+            batch.append(Similarity(first_id=first, second_id=second))
+            if len(batch) >= batch_size:
+                # Pairs already present are skipped by the unique constraint
+                Similarity.objects.bulk_create(batch, ignore_conflicts=True)
+                read += len(batch)
+                batch = []
+                self._report("similarities read", read, started)
+        Similarity.objects.bulk_create(batch, ignore_conflicts=True)
+        read += len(batch)
+        inserted = Similarity.objects.count() - before
+        self._report("similarities", inserted, started)
+        self.stdout.write("similarities: {} duplicates skipped".format(read - inserted))
+
+    def handle(self, *args, **options):
+        if not options["categories"] and not options["similarities"]:
+            raise CommandError("Nothing to load, pass --categories or --similarities")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        try:
+            with transaction.atomic():
+                if options["categories"]:
+                    path = options["categories"]
+                    self._load_categories(
+                        path, self._format(path, options), options["batch_size"]
+                    )
+                    # Counts of existing ancestors change too, one pass over
+                    # the whole tree is cheaper than updating them row by row
+                    aggregates.rebuild(options["batch_size"])
+                    # bulk_create does not send post_save
+                    category_changed(sender=Category)
+                if options["similarities"]:
+                    path = options["similarities"]
+                    self._load_similarities(
+                        path, self._format(path, options), options["batch_size"]
+                    )
+                    similarity_changed(sender=Similarity)
+                    # Relabelling once is cheaper than merging pair by pair
+                    islands.rebuild(options["batch_size"])
+        except (IntegrityError, KeyError, ValueError) as e:
+            raise CommandError("Loading failed, nothing was saved: {!r}".format(e))
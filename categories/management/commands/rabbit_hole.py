@@ -1,45 +1,131 @@
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from django.core.management.base import BaseCommand, CommandError
 
-from categories.models import Category, Similarity
+from categories import snapshot
+from categories.graph import Graph
+
+
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _longest_path(args):
+    component, exact = args
+    return _worker_graph.longest_path(component, exact)
 
 
 class Command(BaseCommand):
     help = "Find the longest similar rabbit hole"
 
-    def _bfs(self, edges, start):
-        visited = set()
-        to_visit = [start]
-        parents = {start: None}
-        distances = {start: 0}
-        while to_visit:
-            current = to_visit.pop(0)
-            visited.add(current)
-            for e in edges:
-                if current in e:
-                    neighbour = sum(e) - current
-                    if neighbour not in visited and neighbour not in to_visit:
-                        to_visit.append(neighbour)
-                        parents[neighbour] = current
-                        distances[neighbour] = distances[current] + 1
-
-        return distances, parents
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Print the result as JSON"
+        )
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            default=None,
+            help="Only report the K largest rabbit islands",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Process islands in a pool of this many processes",
+        )
+        parser.add_argument(
+            "--snapshot",
+            help="Read the similarities from a file written by the snapshot "
+            "command instead of the database",
+        )
+        parser.add_argument(
+            "--approximate",
+            action="store_true",
+            help="Use two BFS sweeps per island instead of one BFS per category",
+        )
+
+    def _longest_paths(self, graph, components, exact, workers):
+        if workers <= 1:
+            return [graph.longest_path(c, exact) for c in components]
+
+        # Single categories are trivial, only ship real islands to the pool
+        paths = [[c[0]] if len(c) == 1 else None for c in components]
+        jobs = [(c, exact) for c in components if len(c) > 1]
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(graph,)
+        ) as pool:
+            results = iter(pool.map(_longest_path, jobs, chunksize=16))
+            for i, path in enumerate(paths):
+                if path is None:
+                    paths[i] = next(results)
+        return paths
 
     def handle(self, *args, **options):
-        vertices = [category.id for category in Category.objects.all()]
-        edges = [(s.first.id, s.second.id) for s in Similarity.objects.all()]
-
-        paths = []
-        islands = set()
-        for v in vertices:
-            distances, parents = self._bfs(edges, v)
-            vertex = max(distances, key=distances.get)
-            path = []
-            while vertex:
-                path.append(vertex)
-                vertex = parents[vertex]
-            paths.append(path)
-            islands.add(tuple(sorted(distances.keys())))
-
-        max_path = max(paths, key=len)
-        self.stdout.write("Longest rabbit hole: {}".format(max_path))
-        self.stdout.write("Rabbit islands: {}".format(islands))
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options["top_k"] is not None and options["top_k"] < 1:
+            raise CommandError("--top-k must be at least 1")
+        timings = {}
+
+        started = time.perf_counter()
+        if options["snapshot"]:
+            try:
+                graph = Graph.from_snapshot(snapshot.load(options["snapshot"]))
+            except (OSError, snapshot.SnapshotError) as e:
+                raise CommandError("Can't load the snapshot: {}".format(e))
+        else:
+            graph = Graph.from_database()
+        timings["load"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        components = graph.components()
+        timings["islands"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        paths = self._longest_paths(
+            graph, components, not options["approximate"], options["workers"]
+        )
+        timings["rabbit_holes"] = time.perf_counter() - started
+
+        # Every path ends at the category it was searched from. Ties go to the
+        # smallest such category, like a scan of the categories in id order.
+        longest = max(paths, key=lambda p: (len(p), -p[-1])) if paths else []
+        ids = graph.ids
+        max_path = [ids[v] for v in longest]
+
+        ranked = sorted(
+            range(len(components)), key=lambda i: len(components[i]), reverse=True
+        )
+        if options["top_k"] is not None:
+            ranked = ranked[: options["top_k"]]
+
+        if options["json"]:
+            islands = [
+                {
+                    "size": len(components[i]),
+                    "categories": [ids[v] for v in components[i]],
+                    "longest_rabbit_hole": [ids[v] for v in paths[i]],
+                }
+                for i in ranked
+            ]
+            result = {
+                "longest_rabbit_hole": max_path,
+                "islands": islands,
+                "timings": timings,
+            }
+            self.stdout.write(json.dumps(result))
+        else:
+            islands = {tuple(ids[v] for v in components[i]) for i in ranked}
+            self.stdout.write("Longest rabbit hole: {}".format(max_path))
+            self.stdout.write("Rabbit islands: {}".format(islands))
+
+        if options["verbosity"] >= 2:
+            for name, seconds in timings.items():
+                self.stderr.write("{}: {:.3f}s".format(name, seconds))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from categories import aggregates
+from categories.models import CycleError
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the path, depth and subtree counts of every category from "
+        "the parent links"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report categories with wrong values and fail if any",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        started = time.perf_counter()
+        try:
+            wrong = aggregates.rebuild(options["batch_size"], fix=not options["verify"])
+        except CycleError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        if options["verify"] and wrong:
+            raise CommandError(
+                "{} categories have wrong tree fields, such as {}".format(
+                    len(wrong), ", ".join(map(str, wrong[:10]))
+                )
+            )
+        action = "verified" if options["verify"] else "fixed {}".format(len(wrong))
+        self.stdout.write("Tree fields {} in {:.2f}s".format(action, elapsed))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from categories import snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the category tree and the similarity graph to a binary file "
+        "that rabbit_hole and the tree cache can map into memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to write, replaced atomically")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            written = snapshot.write(options["path"])
+        except (OSError, snapshot.SnapshotError) as e:
+            raise CommandError("Writing the snapshot failed: {}".format(e))
+        self.stdout.write(
+            "{} categories and {} similarities at versions {}/{} written in "
+            "{:.2f}s".format(
+                len(written),
+                len(written.indices) // 2,
+                written.category_version,
+                written.similarity_version,
+                time.perf_counter() - started,
+            )
+        )
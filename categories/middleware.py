@@ -0,0 +1,76 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from categories import timing
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimingMiddleware:
+    """Report the queries and the time spent handling each request.
+
+    Opt in by adding ``categories.middleware.RequestTimingMiddleware`` to
+    ``MIDDLEWARE``. Every response gets a ``Server-Timing`` header with the
+    database, serializer and render time, and a JSON line is logged to the
+    ``categories.middleware`` logger. Requests that run the same SQL statement
+    ``CATEGORIES_REPEATED_QUERY_THRESHOLD`` times or more are logged as
+    warnings, since their query count grows with the size of the result.
+
+    Queries run while a streaming response is consumed are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with timing.collect() as timings, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings.execute))
+            response = self.get_response(request)
+        timings.add("total", time.perf_counter() - started)
+
+        durations = {
+            name: round(timings.durations[name] * 1000, 3)
+            for name in ("db", "serialize", "render", "total")
+        }
+        response["Server-Timing"] = ", ".join(
+            '{};dur={};desc="{} queries"'.format(name, duration, timings.queries)
+            if name == "db"
+            else "{};dur={}".format(name, duration)
+            for name, duration in durations.items()
+        )
+
+        record = {
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "queries": timings.queries,
+            **{"{}_ms".format(name): duration for name, duration in durations.items()},
+        }
+        repeated = timings.repeated(settings.CATEGORIES_REPEATED_QUERY_THRESHOLD)
+        if repeated:
+            record["repeated_queries"] = [
+                {"sql": sql, "count": count} for sql, count in repeated
+            ]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after the template response hooks
+        timings = timing.current()
+        started = time.perf_counter()
+
+        def rendered(response):
+            timings.add("render", time.perf_counter() - started)
+
+        response.add_post_render_callback(rendered)
+        return response
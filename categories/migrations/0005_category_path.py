@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model("categories", "Category")
+    children = {}
+    for pk, parent_id in Category.objects.values_list("id", "parent_id"):
+        children.setdefault(parent_id, []).append(pk)
+
+    updated = []
+    stack = [(pk, "") for pk in children.get(None, [])]
+    while stack:
+        pk, path = stack.pop()
+        updated.append(Category(id=pk, path=path, depth=path.count("/")))
+        prefix = "{}{}/".format(path, pk)
+        stack.extend((child, prefix) for child in children.get(pk, []))
+    Category.objects.bulk_update(updated, ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0004_similarity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=2048
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
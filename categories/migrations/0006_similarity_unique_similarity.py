@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def canonicalize_similarities(apps, schema_editor):
+    Similarity = apps.get_model("categories", "Similarity")
+    seen = set()
+    duplicates = []
+    swapped = []
+    for similarity in Similarity.objects.order_by("id"):
+        pair = tuple(sorted((similarity.first_id, similarity.second_id)))
+        if pair in seen:
+            duplicates.append(similarity.id)
+            continue
+        seen.add(pair)
+        if pair != (similarity.first_id, similarity.second_id):
+            similarity.first_id, similarity.second_id = pair
+            swapped.append(similarity)
+    for start in range(0, len(duplicates), 500):
+        Similarity.objects.filter(id__in=duplicates[start : start + 500]).delete()
+    Similarity.objects.bulk_update(swapped, ["first", "second"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0005_category_path"),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_similarities, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="similarity",
+            constraint=models.UniqueConstraint(
+                fields=("first", "second"), name="unique_similarity"
+            ),
+        ),
+    ]
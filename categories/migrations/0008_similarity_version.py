@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+def create_versions(apps, schema_editor):
+    Version = apps.get_model("categories", "Version")
+    Version.objects.get_or_create(name="similarity")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0007_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0008_similarity_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="image_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
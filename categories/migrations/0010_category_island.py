@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+def populate_islands(apps, schema_editor):
+    Category = apps.get_model("categories", "Category")
+    Similarity = apps.get_model("categories", "Similarity")
+
+    # Union-find over the similarity edges
+    parents = {}
+
+    def find(pk):
+        root = pk
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while pk != root:
+            parents[pk], pk = root, parents[pk]
+        return root
+
+    for first, second in Similarity.objects.values_list("first_id", "second_id"):
+        first, second = find(first), find(second)
+        if first != second:
+            parents[max(first, second)] = min(first, second)
+
+    # Each island is labelled with its smallest id
+    members = set(parents) | set(parents.values())
+    updated = [Category(id=pk, island=find(pk)) for pk in members]
+    Category.objects.bulk_update(updated, ["island"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0009_category_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="island",
+            field=models.BigIntegerField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(populate_islands, migrations.RunPython.noop),
+    ]
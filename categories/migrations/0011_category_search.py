@@ -0,0 +1,92 @@
+from django.db import migrations
+
+
+# External content FTS5 index over the name and description of categories.
+# unicode61 folds case and strips diacritics in any script, the prefix
+# indexes make autocomplete queries of two or three characters index lookups.
+# Triggers keep it in sync with bulk and raw writes too.
+CREATE = [
+    """
+    CREATE VIRTUAL TABLE categories_category_search USING fts5(
+        name,
+        description,
+        content='categories_category',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER categories_category_search_insert
+    AFTER INSERT ON categories_category BEGIN
+        INSERT INTO categories_category_search(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER categories_category_search_delete
+    AFTER DELETE ON categories_category BEGIN
+        INSERT INTO categories_category_search(
+            categories_category_search, rowid, name, description
+        ) VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER categories_category_search_update
+    AFTER UPDATE OF name, description ON categories_category BEGIN
+        INSERT INTO categories_category_search(
+            categories_category_search, rowid, name, description
+        ) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO categories_category_search(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    # Matches in the name count ten times as much as in the description
+    """
+    INSERT INTO categories_category_search(categories_category_search, rank)
+    VALUES ('rank', 'bm25(10.0, 1.0)')
+    """,
+    """
+    INSERT INTO categories_category_search(categories_category_search)
+    VALUES ('rebuild')
+    """,
+]
+
+DROP = [
+    "DROP TRIGGER IF EXISTS categories_category_search_insert",
+    "DROP TRIGGER IF EXISTS categories_category_search_delete",
+    "DROP TRIGGER IF EXISTS categories_category_search_update",
+    "DROP TABLE IF EXISTS categories_category_search",
+]
+
+
+def _has_fts5(connection):
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends fall back to icontains lookups, see categories.search
+    if _has_fts5(schema_editor.connection):
+        for statement in CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for statement in DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0010_category_island"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+
+def populate_counts(apps, schema_editor):
+    Category = apps.get_model("categories", "Category")
+
+    # Children before parents, each adds its subtree to its parent's
+    rows = sorted(
+        Category.objects.values_list("id", "parent_id", "depth"),
+        key=lambda row: -row[2],
+    )
+    children = {}
+    descendants = {}
+    leaves = {}
+    for pk, parent_id, _ in rows:
+        if parent_id is not None:
+            children[parent_id] = children.get(parent_id, 0) + 1
+            descendants[parent_id] = (
+                descendants.get(parent_id, 0) + descendants.get(pk, 0) + 1
+            )
+            leaves[parent_id] = leaves.get(parent_id, 0) + leaves.get(pk, 1)
+
+    updated = [
+        Category(
+            id=pk,
+            child_count=children[pk],
+            descendant_count=descendants[pk],
+            leaf_count=leaves[pk],
+        )
+        for pk in children
+    ]
+    Category.objects.bulk_update(
+        updated, ["child_count", "descendant_count", "leaf_count"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0011_category_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="child_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="descendant_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="leaf_count",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,190 @@
-from django.db import models
+import random
+
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+
+
+class CycleError(ValueError):
+    pass
+
+
+def subtree_condition(prefix):
+    # Every path in a subtree starts with its prefix. Expressed as a range so
+    # it is answered from the path index on every backend ("0" is the
+    # character right after "/").
+    return Q(path__gte=prefix, path__lt=prefix[:-1] + "0")
 
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     image = models.ImageField(upload_to="images/", null=True, blank=True)
+    # SHA-256 of the uploaded file, shared by categories with the same image
+    image_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     parent = models.ForeignKey("self", blank=True, null=True, on_delete=models.CASCADE)
+    # Materialized ancestry: ids of all ancestors from the root down, each
+    # followed by "/" (e.g. "1/2/" for a category whose parent is 2).
+    path = models.CharField(
+        max_length=2048, blank=True, default="", editable=False, db_index=True
+    )
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Subtree aggregates, see adjust_ancestors. Descendants don't include the
+    # category itself; like leaves(), leaf_count counts a leaf as its own.
+    child_count = models.PositiveIntegerField(default=0, editable=False)
+    descendant_count = models.PositiveIntegerField(default=0, editable=False)
+    leaf_count = models.PositiveIntegerField(default=1, editable=False)
+    # Label of the rabbit island, see categories.islands; null when the
+    # category has no similarities
+    island = models.BigIntegerField(
+        null=True, blank=True, editable=False, db_index=True
+    )
+
+    DERIVED_FIELDS = (
+        "path",
+        "depth",
+        "child_count",
+        "descendant_count",
+        "leaf_count",
+        "island",
+    )
 
     def __str__(self):
         return "{} id {}".format(self.name, self.id)
 
+    @property
+    def subtree_prefix(self):
+        return "{}{}/".format(self.path, self.pk)
+
+    def descendants(self, include_self=False):
+        condition = subtree_condition(self.subtree_prefix)
+        if include_self:
+            condition |= Q(pk=self.pk)
+        return Category.objects.filter(condition)
+
+    def leaves(self):
+        has_children = Category.objects.filter(parent=OuterRef("pk"))
+        return self.descendants(include_self=True).filter(~Exists(has_children))
+
+    def subtree_contains(self, other):
+        """Whether ``other`` is this category or one of its descendants.
+
+        Read from the paths, in O(depth).
+        """
+        return other.subtree_prefix.startswith(self.subtree_prefix)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            with transaction.atomic(savepoint=False):
+                # Like in _move, the parent instance may be stale
+                self.path = ""
+                if self.parent_id is not None:
+                    parent_path = (
+                        Category.objects.filter(pk=self.parent_id)
+                        .values_list("path", flat=True)
+                        .get()
+                    )
+                    self.path = "{}{}/".format(parent_path, self.parent_id)
+                self.depth = self.path.count("/")
+                super().save(*args, **kwargs)
+                self.adjust_ancestors(self.path, 1, 1)
+            return
+
+        if kwargs.get("update_fields") is None:
+            # Tree metadata and the island are maintained by set-based
+            # updates, which an instance loaded earlier must not overwrite
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        if "parent" not in kwargs["update_fields"]:
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            self._move(*args, **kwargs)
+
+    def _move(self, *args, **kwargs):
+        # The stored rows are authoritative, the instances may be stale. A
+        # category moves when its stored parent differs, whatever parent and
+        # path this instance was loaded with.
+        rows = Category.objects.filter(pk__in=[self.pk, self.parent_id])
+        stored = {
+            row[0]: row[1:]
+            for row in rows.values_list(
+                "id", "parent_id", "path", "depth", "descendant_count", "leaf_count"
+            )
+        }
+        old_parent_id, old_path, old_depth, descendants, leaves = stored[self.pk]
+        self.path, self.depth = old_path, old_depth
+        if old_parent_id == self.parent_id:
+            super().save(*args, **kwargs)
+            return
+        old_prefix = self.subtree_prefix
+        if self.parent_id is None:
+            self.path = ""
+        else:
+            parent_path = stored[self.parent_id][1]
+            self.path = "{}{}/".format(parent_path, self.parent_id)
+            if self.path.startswith(old_prefix):
+                raise CycleError(
+                    "Category {} can't be moved under itself or one of its "
+                    "descendants".format(self.pk)
+                )
+        self.depth = self.path.count("/")
+        kwargs["update_fields"] = [*kwargs["update_fields"], "path", "depth"]
+        super().save(*args, **kwargs)
+        if old_prefix != self.subtree_prefix:
+            self._rewrite_subtree(old_prefix, self.depth - old_depth)
+            self.adjust_ancestors(old_path, -descendants - 1, -leaves, -1)
+            self.adjust_ancestors(self.path, descendants + 1, leaves)
+
+    def _rewrite_subtree(self, old_prefix, depth_delta):
+        Category.objects.filter(subtree_condition(old_prefix)).update(
+            path=Concat(
+                Value(self.subtree_prefix), Substr("path", len(old_prefix) + 1)
+            ),
+            depth=F("depth") + depth_delta,
+        )
+
+    @classmethod
+    def adjust_ancestors(cls, path, size, leaves, children=1):
+        """Update the subtree aggregates of the categories in ``path``.
+
+        For ``children`` subtrees holding ``size`` categories and ``leaves``
+        leaves in all, attached below the last category of ``path``; negative
+        numbers detach them. Costs two queries whatever the depth.
+        """
+        ancestors = [int(pk) for pk in path.split("/") if pk]
+        if not ancestors:
+            return
+        parent = ancestors[-1]
+        with transaction.atomic(savepoint=False):
+            before = (
+                cls.objects.filter(pk=parent)
+                .values_list("child_count", flat=True)
+                .first()
+            )
+            # A category without children is a leaf of its own. The parent
+            # is gone when it is deleted together with its children.
+            if before == 0:
+                leaves -= 1
+            if before is not None and before + children == 0:
+                leaves += 1
+            cls.objects.filter(id__in=ancestors).update(
+                child_count=Case(
+                    When(pk=parent, then=F("child_count") + children),
+                    default=F("child_count"),
+                    output_field=models.PositiveIntegerField(),
+                ),
+                descendant_count=F("descendant_count") + size,
+                leaf_count=F("leaf_count") + leaves,
+            )
+
 
 class Similarity(models.Model):
     first = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="first")
@@ -17,5 +192,77 @@ class Similarity(models.Model):
         Category, on_delete=models.CASCADE, related_name="second"
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["first", "second"], name="unique_similarity"
+            ),
+        ]
+
     def __str__(self):
         return "{} ~ {}".format(self.first.id, self.second.id)
+
+    @staticmethod
+    def canonical(first, second):
+        """Similarities are symmetric and stored with the smaller id first."""
+        return (first, second) if first <= second else (second, first)
+
+    @classmethod
+    def between(cls, first, second):
+        first, second = cls.canonical(int(first), int(second))
+        return cls.objects.filter(first_id=first, second_id=second)
+
+    def save(self, *args, **kwargs):
+        self.first_id, self.second_id = self.canonical(self.first_id, self.second_id)
+        super().save(*args, **kwargs)
+
+
+class Version(models.Model):
+    """Change counter for one part of the catalogue, bumped on every write.
+
+    Lets every process tell cheaply whether data it derived from that part,
+    such as a cached tree, is still current. Each bump adds a random step, so
+    a value seen inside a transaction that was rolled back isn't reached again
+    by the next write, which would make caches built from the rolled back
+    data look current.
+    """
+
+    name = models.CharField(max_length=32, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} v{}".format(self.name, self.value)
+
+    @classmethod
+    def bump(cls, name):
+        updated = cls.objects.filter(name=name).update(
+            value=F("value") + random.getrandbits(32) + 1, updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(name=name, defaults={"value": 1})
+
+    @classmethod
+    def snapshot(cls, names):
+        """Map each of ``names`` to its (value, updated_at) in one query."""
+        rows = cls.objects.filter(name__in=names).values_list(
+            "name", "value", "updated_at"
+        )
+        result = dict.fromkeys(names, (0, None))
+        result.update((name, (value, updated_at)) for name, value, updated_at in rows)
+        return result
+
+    @classmethod
+    async def asnapshot(cls, names):
+        rows = cls.objects.filter(name__in=names).values_list(
+            "name", "value", "updated_at"
+        )
+        result = dict.fromkeys(names, (0, None))
+        async for name, value, updated_at in rows:
+            result[name] = (value, updated_at)
+        return result
+
+    @classmethod
+    def current(cls, name):
+        value = cls.objects.filter(name=name).values_list("value", flat=True).first()
+        return value or 0
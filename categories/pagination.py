@@ -0,0 +1,111 @@
+from bisect import bisect_left, bisect_right
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key.
+
+    Each page is fetched with ``id > last seen id`` so deep pages cost the same
+    as the first one. Page size defaults to the ``PAGE_SIZE`` setting and can
+    be lowered or raised (up to ``max_page_size``) with ``?page_size=``.
+    """
+
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def decode_cursor(self, request):
+        # Positions are ids or island labels, a tampered cursor must not reach
+        # the database as anything but an integer
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            return cursor._replace(position=int(cursor.position))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_ids(self, ids, request, view=None):
+        """Paginate a sorted list of ids the way ``paginate_queryset`` would.
+
+        Returns the ids of the requested page, so that only those rows have to
+        be loaded. Cursors and links are interchangeable with the queryset
+        path.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, None, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+
+        if reverse:
+            end = len(ids) if position is None else bisect_left(ids, position)
+            start = max(end - self.page_size, 0)
+            self.has_next = position is not None
+            self.next_position = str(position)
+            self.has_previous = start > 0
+            if self.has_previous:
+                self.previous_position = str(ids[start - 1])
+        else:
+            start = 0 if position is None else bisect_right(ids, position)
+            end = start + self.page_size
+            self.has_next = end < len(ids)
+            if self.has_next:
+                self.next_position = str(ids[end])
+            self.has_previous = position is not None
+            self.previous_position = str(position)
+
+        page = ids[start:end]
+        self.page = [{"id": pk} for pk in page]
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return page
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async counterpart of ``paginate_queryset``, using the async ORM."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by("-id")
+            if position is not None:
+                queryset = queryset.filter(id__lt=position)
+        else:
+            queryset = queryset.order_by("id")
+            if position is not None:
+                queryset = queryset.filter(id__gt=position)
+        results = [row async for row in queryset[: self.page_size + 1]]
+        self.page = results[: self.page_size]
+        following = str(results[-1].pk) if len(results) > len(self.page) else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.next_position = position
+            self.has_previous = following is not None
+            self.previous_position = following
+        else:
+            self.has_next = following is not None
+            self.next_position = following
+            self.has_previous = position is not None
+            self.previous_position = position
+        return self.page
+
+
+class IslandCursorPagination(IdCursorPagination):
+    """Keyset pagination of rabbit islands on their label."""
+
+    ordering = "island"
@@ -0,0 +1,49 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that encodes with orjson when it is installed.
+
+    The output is what ``JSONRenderer`` produces with the default settings:
+    compact, UTF-8, with U+2028 and U+2029 escaped, and dates, decimals and
+    lazy strings formatted by DRF's encoder. Indented output, other JSON
+    settings and data orjson can't encode are left to ``JSONRenderer``.
+
+    Floats are the exception. They parse to the same values but may be
+    written differently, such as ``1e16`` for ``1e+16`` or ``0.00001`` for
+    ``1e-05``, and NaN and infinities, which ``JSONRenderer`` refuses, are
+    written as ``null``. Catalogue responses hold no floats.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            data is None
+            or orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(
+                data,
+                default=_encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except orjson.JSONEncodeError:
+            # Such as non-string keys or integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
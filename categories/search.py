@@ -0,0 +1,128 @@
+"""Search of categories by name and description.
+
+On SQLite the FTS5 index created by migration 0011 is used, ranked by BM25
+with name matches weighing ten times description matches. Other databases,
+or SQLite builds without FTS5, fall back to unranked ``icontains`` lookups.
+"""
+
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from categories.models import Category
+
+
+TABLE = "categories_category_search"
+
+# Same as in migration 0011. SQLite drops them whenever a migration remakes
+# the category table, restore_triggers puts them back.
+TRIGGERS = {
+    "categories_category_search_insert": """
+        CREATE TRIGGER categories_category_search_insert
+        AFTER INSERT ON categories_category BEGIN
+            INSERT INTO categories_category_search(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """,
+    "categories_category_search_delete": """
+        CREATE TRIGGER categories_category_search_delete
+        AFTER DELETE ON categories_category BEGIN
+            INSERT INTO categories_category_search(
+                categories_category_search, rowid, name, description
+            ) VALUES ('delete', old.id, old.name, old.description);
+        END
+    """,
+    "categories_category_search_update": """
+        CREATE TRIGGER categories_category_search_update
+        AFTER UPDATE OF name, description ON categories_category BEGIN
+            INSERT INTO categories_category_search(
+                categories_category_search, rowid, name, description
+            ) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO categories_category_search(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """,
+}
+
+_available = {}
+
+
+def has_index(using="default"):
+    """Whether the FTS5 index exists on the database ``using``."""
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (
+            connection.vendor == "sqlite"
+            and TABLE in connection.introspection.table_names()
+        )
+    return _available[using]
+
+
+def restore_triggers(using="default"):
+    """Recreate missing sync triggers and then rebuild the index.
+
+    Returns whether anything had to be restored.
+    """
+    _available.pop(using, None)
+    if not has_index(using):
+        return False
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+            [Category._meta.db_table],
+        )
+        missing = set(TRIGGERS) - {name for (name,) in cursor.fetchall()}
+        for name in sorted(missing):
+            cursor.execute(TRIGGERS[name])
+        if missing:
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(TABLE))
+    return bool(missing)
+
+
+def terms(query):
+    """Words of ``query``, split the way the unicode61 tokenizer splits text."""
+    return re.findall(r"\w+", query)
+
+
+def match_expression(words, autocomplete=False):
+    """FTS5 query matching every word, each quoted so none acts as syntax.
+
+    In autocomplete mode only names are searched and the last word matches as
+    a prefix, since it is usually still being typed.
+    """
+    quoted = ['"{}"'.format(word) for word in words]
+    if not autocomplete:
+        return " ".join(quoted)
+    quoted[-1] += "*"
+    return "{{name}} : ({})".format(" ".join(quoted))
+
+
+def search(query, autocomplete=False, limit=20, using="default"):
+    """Ids of the categories best matching ``query``, best first.
+
+    Autocomplete results are in id order instead.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    if has_index(using):
+        # Ranking reads every match, while in rowid order FTS5 stops after
+        # ``limit`` of them, so autocomplete stays fast on very short prefixes
+        order = "rowid" if autocomplete else "rank, rowid"
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM {0} WHERE {0} MATCH %s "
+                "ORDER BY {1} LIMIT %s".format(TABLE, order),
+                [match_expression(words, autocomplete), limit],
+            )
+            return [pk for (pk,) in cursor.fetchall()]
+
+    condition = Q()
+    for word in words:
+        if autocomplete:
+            condition &= Q(name__icontains=word)
+        else:
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+    categories = Category.objects.using(using).filter(condition).order_by("id")
+    return list(categories.values_list("id", flat=True)[:limit])
@@ -1,14 +1,293 @@
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
+from categories import timing
 from categories.models import Category, Similarity
 
 
-class CategorySerializer(serializers.ModelSerializer):
+def image_url_prefix(request):
+    """Absolute URL that stored image names are appended to.
+
+    Built once per request instead of once per row, matching what the
+    ``image`` field of ``CategorySerializer`` renders.
+    """
+    return request.build_absolute_uri(Category.image.field.storage.url(""))
+
+
+def image_url(prefix, name):
+    return prefix + filepath_to_uri(name) if name else None
+
+
+def image_variant_urls(prefix, variants):
+    return {
+        label: {key: image_url(prefix, name) for key, name in formats.items()}
+        for label, formats in variants.items()
+    }
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timing.measure("serialize"):
+            return super().data
+
+
+class TimedSerializer(serializers.ModelSerializer):
+    """Adds the time spent producing ``data`` to the request timings."""
+
+    @property
+    def data(self):
+        with timing.measure("serialize"):
+            return super().data
+
+
+class CategorySerializer(TimedSerializer):
+    """Category with its default fields, or just ``fields`` when it is given.
+
+    The tree fields in ``optional_fields`` are stored on the category, so they
+    cost no extra query, but are only included when asked for.
+    """
+
+    image_variants = serializers.SerializerMethodField()
+
+    optional_fields = ["depth", "child_count", "descendant_count", "leaf_count"]
+
     class Meta:
         model = Category
-        fields = ["id", "name", "description", "image", "parent"]
+        fields = [
+            "id",
+            "name",
+            "description",
+            "image",
+            "image_variants",
+            "parent",
+            "depth",
+            "child_count",
+            "descendant_count",
+            "leaf_count",
+        ]
+        list_serializer_class = TimedListSerializer
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            fields = DEFAULT_CATEGORY_FIELDS
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+    def validate_parent(self, parent):
+        category = self.instance
+        if parent is not None and category and category.subtree_contains(parent):
+            raise serializers.ValidationError(
+                "A category can't be moved under itself or one of its descendants"
+            )
+        return parent
+
+    def get_image_variants(self, category):
+        if not category.image_variants:
+            return {}
+        # The context is shared by every row of a list, build the prefix once
+        if "image_url_prefix" not in self.context:
+            request = self.context["request"]
+            self.context["image_url_prefix"] = image_url_prefix(request)
+        prefix = self.context["image_url_prefix"]
+        return image_variant_urls(prefix, category.image_variants)
+
+
+DEFAULT_CATEGORY_FIELDS = [
+    field
+    for field in CategorySerializer.Meta.fields
+    if field not in CategorySerializer.optional_fields
+]
+
+# Database column behind each CategorySerializer field
+CATEGORY_COLUMNS = {
+    "id": "id",
+    "name": "name",
+    "description": "description",
+    "image": "image",
+    "image_variants": "image_variants",
+    "parent": "parent_id",
+    "depth": "depth",
+    "child_count": "child_count",
+    "descendant_count": "descendant_count",
+    "leaf_count": "leaf_count",
+}
+
+
+def category_fields(query_params):
+    """Category fields picked with ``?fields=`` and ``?exclude=``.
+
+    Both take comma separated field names. ``?fields=`` may name optional
+    fields, ``?exclude=`` removes fields from the default ones. The fields
+    keep the order of ``CategorySerializer`` and always include ``id``.
+    """
+    available = CategorySerializer.Meta.fields
+    fields = DEFAULT_CATEGORY_FIELDS
+    if "fields" in query_params:
+        fields = available
+    for param in ("fields", "exclude"):
+        if param not in query_params:
+            continue
+        names = {name for name in query_params[param].split(",") if name}
+        unknown = names - set(available)
+        if unknown:
+            raise serializers.ValidationError(
+                {"Invalid fields": "{} is not a category field".format(min(unknown))}
+            )
+        if param == "fields":
+            fields = [f for f in fields if f in names or f == "id"]
+        else:
+            fields = [f for f in fields if f not in names or f == "id"]
+    return fields
+
+
+def category_columns(fields):
+    return [CATEGORY_COLUMNS[field] for field in fields]
+
 
+def category_records(rows, request, fields=None):
+    """Build the ``CategorySerializer`` output for ``values()`` rows.
 
-class SimilaritySerializer(serializers.ModelSerializer):
+    Used by the list endpoints, which skip creating a model instance and
+    running every serializer field for each row. The image URL prefix is
+    built once for all rows. ``rows`` need the columns of ``fields``.
+    """
+    with timing.measure("serialize"):
+        prefix = image_url_prefix(request)
+        if fields is None or fields == DEFAULT_CATEGORY_FIELDS:
+            return [
+                {
+                    "id": row["id"],
+                    "name": row["name"],
+                    "description": row["description"],
+                    "image": image_url(prefix, row["image"]),
+                    "image_variants": image_variant_urls(
+                        prefix, row["image_variants"]
+                    ),
+                    "parent": row["parent_id"],
+                }
+                for row in rows
+            ]
+
+        converters = {
+            "image": lambda name: image_url(prefix, name),
+            "image_variants": lambda variants: image_variant_urls(prefix, variants),
+        }
+        columns = [
+            (field, CATEGORY_COLUMNS[field], converters.get(field)) for field in fields
+        ]
+        return [
+            {
+                field: convert(row[column]) if convert else row[column]
+                for field, column, convert in columns
+            }
+            for row in rows
+        ]
+
+
+class CategoryMoveSerializer(serializers.Serializer):
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Category.objects.all(), allow_null=True
+    )
+
+
+class BatchQuerySerializer(serializers.Serializer):
+    """One query of a ``/categories/batch/`` request.
+
+    ``depth`` only applies to ``similar`` queries. ``limit`` caps the number
+    of categories returned, the view defaults it to the page size.
+    """
+
+    query_types = [
+        "category",
+        "subcategories",
+        "siblings",
+        "leaves",
+        "descendants",
+        "similar",
+    ]
+
+    id = serializers.IntegerField()
+    type = serializers.ChoiceField(choices=query_types)
+    depth = serializers.IntegerField(min_value=1, default=1)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+
+
+class SimilaritySerializer(TimedSerializer):
     class Meta:
         model = Similarity
         fields = ["first", "second"]
+        list_serializer_class = TimedListSerializer
+
+
+class BulkCategoryListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        keys = [item["key"] for item in attrs if "key" in item]
+        if len(keys) != len(set(keys)):
+            raise serializers.ValidationError("Keys must be unique within a batch")
+        for item in attrs:
+            if "parent_key" in item and item["parent_key"] not in keys:
+                raise serializers.ValidationError(
+                    "Unknown parent_key {}".format(item["parent_key"])
+                )
+
+        parents = {item["parent"] for item in attrs if item.get("parent")}
+        existing = set(
+            Category.objects.filter(id__in=parents).values_list("id", flat=True)
+        )
+        if parents - existing:
+            raise serializers.ValidationError(
+                "Unknown parent {}".format(min(parents - existing))
+            )
+        return attrs
+
+
+class BulkCategorySerializer(serializers.ModelSerializer):
+    """One category of a bulk create.
+
+    ``parent`` refers to an existing category, ``parent_key`` to the ``key``
+    of another category in the same batch.
+    """
+
+    key = serializers.CharField(required=False)
+    parent = serializers.IntegerField(required=False, allow_null=True)
+    parent_key = serializers.CharField(required=False)
+
+    class Meta:
+        model = Category
+        fields = ["key", "name", "description", "parent", "parent_key"]
+        list_serializer_class = BulkCategoryListSerializer
+
+    def validate(self, attrs):
+        if attrs.get("parent") is not None and "parent_key" in attrs:
+            raise serializers.ValidationError(
+                "Only one of parent and parent_key can be given"
+            )
+        return attrs
+
+
+class BulkCategoryUpdateListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        ids = [item["id"] for item in attrs]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Ids must be unique within a batch")
+        referenced = set(ids) | {item["parent"] for item in attrs if item.get("parent")}
+        existing = set(
+            Category.objects.filter(id__in=referenced).values_list("id", flat=True)
+        )
+        if referenced - existing:
+            raise serializers.ValidationError(
+                "Unknown category {}".format(min(referenced - existing))
+            )
+        return attrs
+
+
+class BulkCategoryUpdateSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
+    parent = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Category
+        fields = ["id", "name", "description", "parent"]
+        extra_kwargs = {"name": {"required": False}, "description": {"required": False}}
+        list_serializer_class = BulkCategoryUpdateListSerializer
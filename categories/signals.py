@@ -0,0 +1,54 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from categories import db, graph_cache, islands, search, tree_cache
+from categories.models import Category, Similarity, Version
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    Version.bump("category")
+    tree_cache.invalidate()
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    # The collector deletes a subtree row by row, each row only accounts for
+    # itself in the ancestors that remain
+    leaves = 1 if instance.child_count == 0 else 0
+    Category.adjust_ancestors(instance.path, -1, -leaves, -1)
+
+
+@receiver(post_save, sender=Similarity)
+@receiver(post_delete, sender=Similarity)
+def similarity_changed(sender, **kwargs):
+    Version.bump("similarity")
+    graph_cache.invalidate()
+
+
+@receiver(post_save, sender=Similarity)
+def similarity_saved(sender, instance, created, **kwargs):
+    if created:
+        islands.merge(instance.first_id, instance.second_id)
+    else:
+        # The similarity it replaced is unknown
+        islands.rebuild()
+
+
+@receiver(post_delete, sender=Similarity)
+def similarity_deleted(sender, instance, **kwargs):
+    islands.split(instance.first_id)
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, using, **kwargs):
+    if sender.name == "categories":
+        search.restore_triggers(using)
+
+
+@receiver(connection_created)
+def database_connected(sender, connection, **kwargs):
+    if connection.vendor == "sqlite":
+        db.configure_sqlite(connection)
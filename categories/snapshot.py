@@ -0,0 +1,182 @@
+"""Binary snapshot of the catalogue structure, mapped into memory to read it.
+
+The file holds a 64 byte header followed by arrays of 64-bit integers:
+
+* ``ids``, the category ids in ascending order; every other array refers to
+  categories by their position in it
+* ``parent``, ``first_child`` and ``next_sibling``, the links of
+  ``tree_cache.TreeSnapshot``, -1 where there is none
+* ``indptr`` and ``indices``, the similarity adjacency lists in the CSR form
+  of ``graph.Graph``
+
+The header records the format version, the byte order of the arrays and the
+category and similarity versions the snapshot was taken at. Loading maps the
+file and hands out memoryviews on it, so nothing is read or copied until it
+is used, and processes loading the same file share its pages.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from django.db import transaction
+
+from categories.graph import Graph
+from categories.models import Version
+from categories.tree_cache import TreeSnapshot
+
+
+MAGIC = b"CATSNAP\x00"
+FORMAT_VERSION = 1
+# magic, format version, flags, category version, similarity version,
+# number of categories, number of adjacency entries, first root
+HEADER = struct.Struct("<8sIIqqqqq")
+HEADER_SIZE = 64
+BIG_ENDIAN = 1
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class PositionIndex:
+    """Position of each id in a sorted id array, found by binary search.
+
+    Stands in for the ``{id: position}`` dicts of ``Graph`` and
+    ``TreeSnapshot``, which would take as long to build as the snapshot saves.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, pk, default=None):
+        i = bisect_left(self.ids, pk)
+        if i < len(self.ids) and self.ids[i] == pk:
+            return i
+        return default
+
+    def __contains__(self, pk):
+        return self.get(pk) is not None
+
+    def __getitem__(self, pk):
+        i = self.get(pk)
+        if i is None:
+            raise KeyError(pk)
+        return i
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+                raise SnapshotError("{} is not a catalogue snapshot".format(path))
+            (
+                _,
+                format_version,
+                flags,
+                self.category_version,
+                self.similarity_version,
+                n,
+                entries,
+                self.first_root,
+            ) = HEADER.unpack_from(header)
+            if format_version != FORMAT_VERSION:
+                raise SnapshotError(
+                    "{} has snapshot format {}, {} is supported".format(
+                        path, format_version, FORMAT_VERSION
+                    )
+                )
+            size = HEADER_SIZE + 8 * (5 * n + 1 + entries)
+            if os.fstat(f.fileno()).st_size != size:
+                raise SnapshotError("{} is truncated".format(path))
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        swap = bool(flags & BIG_ENDIAN) != (sys.byteorder == "big")
+        view = memoryview(self._mapped)
+        offset = HEADER_SIZE
+        arrays = []
+        for length in (n, n, n, n, n + 1, entries):
+            values = view[offset : offset + 8 * length].cast("q")
+            if swap:
+                # Written on a machine of the other byte order, copy
+                values = array("q", values)
+                values.byteswap()
+            arrays.append(values)
+            offset += 8 * length
+        (
+            self.ids,
+            self.parent,
+            self.first_child,
+            self.next_sibling,
+            self.indptr,
+            self.indices,
+        ) = arrays
+        self.index = PositionIndex(self.ids)
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of receiving a copy
+        return (Snapshot, (self.path,))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def parent_id(self, pk):
+        parent = self.parent[self.index[pk]]
+        return None if parent == -1 else self.ids[parent]
+
+
+load = Snapshot
+
+
+def write(path):
+    """Write a snapshot of the catalogue to ``path``, replacing it atomically.
+
+    Returns the loaded snapshot.
+    """
+    with transaction.atomic():
+        versions = Version.snapshot(["category", "similarity"])
+        tree = TreeSnapshot.from_database(versions["category"][0])
+        graph = Graph.from_database()
+    if list(tree.ids) != list(graph.ids):
+        raise SnapshotError("Categories changed while the snapshot was taken")
+
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        BIG_ENDIAN if sys.byteorder == "big" else 0,
+        versions["category"][0],
+        versions["similarity"][0],
+        len(tree.ids),
+        len(graph.indices),
+        tree.first_root,
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\x00"))
+            for values in (
+                tree.ids,
+                tree.parent,
+                tree.first_child,
+                tree.next_sibling,
+                graph.indptr,
+                graph.indices,
+            ):
+                values.tofile(f)
+        # mkstemp makes the file private, other processes need to read it
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return Snapshot(path)
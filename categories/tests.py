@@ -1,14 +1,31 @@
+import datetime
+import gzip
 import json
+import os
+import pickle
+import random
 import tempfile
 from PIL import Image
+from decimal import Decimal
 from io import StringIO
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, modify_settings, override_settings
 from django.core import management
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 
-from categories.models import Category, Similarity
+from categories import aggregates, snapshot, tree_cache
+from categories.graph import Graph
+from categories.models import Category, Similarity, Version
+from categories.renderers import FastJSONRenderer
+from categories.serializers import CategorySerializer
 
 
 class CategoryTests(APITestCase):
@@ -26,7 +43,7 @@ class CategoryTests(APITestCase):
         self.client.post("/categories/", data, format="json")
         response = self.client.get("/categories/", format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(json.loads(response.getvalue())), 2)
+        self.assertEqual(len(json.loads(response.getvalue())["results"]), 2)
 
     def test_list_category_with_id(self):
         data = {"name": "банани", "description": "Еквадор"}
@@ -61,20 +78,177 @@ class CategoryTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Category.objects.count(), 0)
 
-    def test_upload_image(self):
-        data = {"name": "банани", "description": "Еквадор"}
-        self.client.post("/categories/", data, format="json")
-        category = Category.objects.get()
-        image = Image.new("RGB", (100, 100))
+    def _upload(self, pk, color):
+        image = Image.new("RGB", (1000, 500), color)
         tmp_file = tempfile.NamedTemporaryFile(suffix=".jpg", prefix="test_img_")
         image.save(tmp_file, "jpeg")
         tmp_file.seek(0)
         data = {"file": tmp_file}
-        response = self.client.put("/categories/1/upload/", data, format="multipart")
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertIsNotNone(category.image)
-        category = Category.objects.get()
-        category.image.delete(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(
+                "/categories/{}/upload/".format(pk), data, format="multipart"
+            )
+
+    @override_settings(CATEGORIES_IMAGE_WORKERS=0)
+    def test_upload_image(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                data = {"name": "банани", "description": "Еквадор"}
+                self.client.post("/categories/", data, format="json")
+                response = self._upload(1, "red")
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                category = Category.objects.get()
+                self.assertTrue(category.image.storage.exists(category.image.name))
+
+    def test_upload_rejects_other_files(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                Category.objects.create(name="банани", description="Еквадор")
+                upload = StringIO("not an image")
+                upload.name = "bananas.jpg"
+                response = self.client.put(
+                    "/categories/1/upload/", {"file": upload}, format="multipart"
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                response = self.client.put(
+                    "/categories/1/upload/", {}, format="multipart"
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertFalse(Category.objects.get().image)
+                self.assertEqual(os.listdir(media_root), [])
+
+    @override_settings(CATEGORIES_IMAGE_WORKERS=0)
+    def test_upload_image_variants(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                Category.objects.create(name="банани", description="Еквадор")
+                Category.objects.create(name="круши", description="Кичево")
+                self._upload(1, "red")
+                self._upload(2, "red")
+                first, second = Category.objects.order_by("id")
+                self.assertEqual(first.image.name, second.image.name)
+                self.assertEqual(first.image_hash, second.image_hash)
+                thumbnail = first.image_variants["thumbnail"]
+                with Image.open(first.image.storage.path(thumbnail["webp"])) as image:
+                    self.assertEqual(image.format, "WEBP")
+                    self.assertEqual(image.size, (128, 64))
+
+                response = self.client.get("/categories/1/")
+                variants = json.loads(response.getvalue())["image_variants"]
+                self.assertEqual(
+                    variants["thumbnail"]["jpeg"],
+                    "http://testserver/media/" + thumbnail["jpeg"],
+                )
+
+    def test_move_rejects_cycles(self):
+        for name, parent in [("плодове", None), ("ябълки", 1), ("айвър", 2)]:
+            Category.objects.create(name=name, description="", parent_id=parent)
+        data = {"name": "плодове", "description": "", "parent": 3}
+        response = self.client.put("/categories/1/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post("/categories/2/move/", {"parent": 2}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(
+            "/categories/bulk/",
+            [{"id": 3, "parent": None}, {"id": 1, "parent": 2}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            list(Category.objects.order_by("id").values_list("parent", "path")),
+            [(None, ""), (1, "1/"), (2, "1/2/")],
+        )
+
+    def test_move_subtree(self):
+        for name, parent in [("плодове", None), ("ябълки", 1), ("айвър", 2)]:
+            Category.objects.create(name=name, description="", parent_id=parent)
+        Category.objects.create(name="зеленчуци", description="")
+        response = self.client.post("/categories/2/move/", {"parent": 4}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["parent"], 4)
+        self.assertEqual(
+            list(Category.objects.order_by("id").values_list("path", "depth")),
+            [("", 0), ("4/", 1), ("4/2/", 2), ("", 0)],
+        )
+        response = self.client.get("/categories/4/descendants/")
+        self.assertEqual([r["id"] for r in response.json()["results"]], [2, 3, 4])
+        response = self.client.post(
+            "/categories/3/move/", {"parent": None}, format="json"
+        )
+        self.assertEqual(Category.objects.get(pk=3).path, "")
+
+    def test_create_under_stale_parent(self):
+        fruit = Category.objects.create(name="плодове", description="")
+        Category.objects.create(name="зеленчуци", description="")
+        moved = Category.objects.get(pk=1)
+        moved.parent_id = 2
+        moved.save()
+        apples = Category.objects.create(name="ябълки", description="", parent=fruit)
+        self.assertEqual((apples.path, apples.depth), ("2/1/", 2))
+        self.assertEqual(aggregates.rebuild(fix=False), [])
+
+    def test_save_stale_instance(self):
+        for name, parent in [("плодове", None), ("зеленчуци", None), ("айвър", 1)]:
+            Category.objects.create(name=name, description="", parent_id=parent)
+        stale = Category.objects.get(pk=3)
+        moved = Category.objects.get(pk=3)
+        moved.parent_id = 2
+        moved.save()
+        # The stale instance still holds parent 1, saving it moves the
+        # category back, with its path and counts
+        stale.name = "лютеница"
+        stale.save()
+        self.assertEqual(
+            Category.objects.filter(pk=3).values_list("name", "parent", "path").get(),
+            ("лютеница", 1, "1/"),
+        )
+        self.assertEqual(aggregates.rebuild(fix=False), [])
+
+    def test_delete_subtree(self):
+        for name, parent in [("плодове", None), ("ябълки", 1), ("айвър", 2)]:
+            Category.objects.create(name=name, description="", parent_id=parent)
+        Category.objects.create(name="круши", description="")
+        Category.objects.create(name="сливи", description="")
+        for first, second in [(3, 4), (4, 5), (1, 5)]:
+            Similarity.objects.create(first_id=first, second_id=second)
+        version = Version.current("category")
+
+        response = self.client.delete("/categories/1/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            list(Category.objects.order_by("id").values_list("id", "island")),
+            [(4, 4), (5, 4)],
+        )
+        self.assertEqual(
+            list(Similarity.objects.values_list("first", "second")), [(4, 5)]
+        )
+        self.assertGreater(Version.current("category"), version)
+        response = self.client.get("/categories/4/similar/?depth=2")
+        self.assertEqual([r["id"] for r in response.json()["results"]], [5])
+
+    @override_settings(CATEGORIES_IMAGE_WORKERS=0)
+    def test_delete_subtree_images(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                Category.objects.create(name="плодове", description="")
+                Category.objects.create(name="ябълки", description="", parent_id=1)
+                Category.objects.create(name="круши", description="")
+                self._upload(2, "red")
+                self._upload(3, "red")
+                category = Category.objects.get(pk=3)
+                storage = category.image.storage
+                files = [category.image.name] + [
+                    name
+                    for formats in category.image_variants.values()
+                    for name in formats.values()
+                ]
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.delete("/categories/1/")
+                self.assertTrue(all(storage.exists(name) for name in files))
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.delete("/categories/3/")
+                self.assertFalse(any(storage.exists(name) for name in files))
 
 
 class CategoriesListingTest(APITestCase):
@@ -96,30 +270,130 @@ class CategoriesListingTest(APITestCase):
         self.assertEqual(Category.objects.count(), 5)
         response = self.client.get("/categories/1/subcategories/", format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        result = [category["id"] for category in json.loads(response.getvalue())]
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
         self.assertEqual(result, [2, 3])
 
     def test_list_leaves(self):
         self.assertEqual(Category.objects.count(), 5)
         response = self.client.get("/categories/1/leaves/", format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        result = [category["id"] for category in json.loads(response.getvalue())]
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
         self.assertEqual(result, [4, 5])
 
     def test_list_descendants(self):
         self.assertEqual(Category.objects.count(), 5)
         response = self.client.get("/categories/1/descendants/", format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        result = [category["id"] for category in json.loads(response.getvalue())]
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
         self.assertEqual(result, [1, 2, 3, 4, 5])
 
     def test_list_siblings(self):
         self.assertEqual(Category.objects.count(), 5)
         response = self.client.get("/categories/2/siblings/", format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        result = [category["id"] for category in json.loads(response.getvalue())]
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
         self.assertEqual(result, [2, 3])
 
+    def test_list_descendants_after_move(self):
+        data = {"name": "малини", "description": "text", "parent": 4}
+        self.client.put("/categories/3/", data, format="json")
+        self.assertEqual(Category.objects.get(pk=5).path, "1/2/4/3/")
+        response = self.client.get("/categories/2/descendants/", format="json")
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
+        self.assertEqual(result, [2, 3, 4, 5])
+        response = self.client.get("/categories/2/leaves/", format="json")
+        results = json.loads(response.getvalue())["results"]
+        result = [category["id"] for category in results]
+        self.assertEqual(result, [5])
+
+    @override_settings(CATEGORIES_TREE_CACHE=False)
+    def test_list_descendants_single_query(self):
+        # Version check, the category and its descendants
+        with self.assertNumQueries(3):
+            response = self.client.get("/categories/1/descendants/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(3):
+            response = self.client.get("/categories/1/leaves/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cursor_pagination(self):
+        response = self.client.get("/categories/1/descendants/?page_size=2")
+        page = json.loads(response.getvalue())
+        self.assertEqual([category["id"] for category in page["results"]], [1, 2])
+        self.assertIsNone(page["previous"])
+        response = self.client.get(page["next"])
+        page = json.loads(response.getvalue())
+        self.assertEqual([category["id"] for category in page["results"]], [3, 4])
+        response = self.client.get(page["previous"])
+        page = json.loads(response.getvalue())
+        self.assertEqual([category["id"] for category in page["results"]], [1, 2])
+
+    def test_invalid_cursor(self):
+        urls = ["/categories/", "/categories/1/leaves/", "/similarity/", "/islands/"]
+        for url in urls:
+            # p=abc
+            response = self.client.get(url, {"cursor": "cD1hYmM="})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_listing_from_tree_snapshot(self):
+        self.client.get("/categories/1/leaves/")
+        # Version check and loading the page rows
+        with self.assertNumQueries(2):
+            response = self.client.get("/categories/1/leaves/")
+        results = json.loads(response.getvalue())["results"]
+        self.assertEqual([category["id"] for category in results], [4, 5])
+
+    def test_tree_snapshot_follows_other_processes(self):
+        self.client.get("/categories/1/subcategories/")
+        # A write from another process only shows up as a new version
+        Category.objects.filter(pk=4).update(parent=1)
+        Version.bump("category")
+        response = self.client.get("/categories/1/subcategories/")
+        results = json.loads(response.getvalue())["results"]
+        self.assertEqual([category["id"] for category in results], [2, 3, 4])
+
+    def test_tree_snapshot_ignores_rolled_back_writes(self):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Category.objects.create(name="сливи", description="", parent_id=4)
+                self.client.get("/categories/4/subcategories/")
+                raise IntegrityError
+        # Another process then writes, which must not reach the version seen
+        # inside the rolled back transaction again
+        Category.objects.filter(pk=5).update(parent=4)
+        Version.bump("category")
+        response = self.client.get("/categories/4/subcategories/")
+        results = json.loads(response.getvalue())["results"]
+        self.assertEqual([category["id"] for category in results], [5])
+
+    def test_listing_missing_category(self):
+        response = self.client.get("/categories/42/leaves/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_subtree(self):
+        with self.assertNumQueries(3):
+            response = self.client.get("/categories/1/tree/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tree = json.loads(response.getvalue())
+        self.assertEqual(tree["id"], 1)
+        self.assertEqual([child["id"] for child in tree["children"]], [2, 3])
+        self.assertEqual(tree["children"][1]["children"][0]["id"], 5)
+        self.assertEqual(tree["children"][1]["children"][0]["children"], [])
+
+    def test_subtree_depth(self):
+        response = self.client.get("/categories/2/tree/?depth=0")
+        self.assertEqual(json.loads(response.getvalue())["children"], [])
+        response = self.client.get("/categories/1/tree/?depth=1")
+        tree = json.loads(response.getvalue())
+        self.assertEqual(tree["children"][0]["children"], [])
+        response = self.client.get("/categories/1/tree/?depth=-1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_wrong_type_listing(self):
         self.assertEqual(Category.objects.count(), 5)
         response = self.client.get("/categories/2/sfweggr/", format="json")
@@ -161,7 +435,7 @@ class SimilarityTest(APITestCase):
         self.client.post("/similarity/", {"first": 2, "second": 4}, format="json")
         response = self.client.get("/similarity/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(json.loads(response.getvalue())), 2)
+        self.assertEqual(len(json.loads(response.getvalue())["results"]), 2)
 
     def test_add_similarity_for_category(self):
         count_before = Similarity.objects.count()
@@ -186,7 +460,7 @@ class SimilarityTest(APITestCase):
         self.client.post("/similarity/", {"first": 4, "second": 1}, format="json")
         response = self.client.get("/categories/1/similar/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(json.loads(response.getvalue())), 2)
+        self.assertEqual(len(json.loads(response.getvalue())["results"]), 2)
 
     def test_remove_similarity_for_category(self):
         count_before = Similarity.objects.count()
@@ -208,6 +482,599 @@ class SimilarityTest(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_similarity_stored_in_canonical_order(self):
+        response = self.client.post(
+            "/similarity/", {"first": 4, "second": 2}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.getvalue()), {"first": 2, "second": 4})
+        response = self.client.post(
+            "/categories/2/similar/", {"category": 4}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_208_ALREADY_REPORTED)
+        self.assertEqual(Similarity.objects.count(), 1)
+
+    def test_remove_similarity_single_query(self):
+        self.client.post("/similarity/", {"first": 1, "second": 2}, format="json")
+        # Lookup, delete, version bump, then reading the island's categories
+        # and similarities to split it and one update
+        with self.assertNumQueries(7):
+            response = self.client.patch(
+                "/categories/2/similar/", {"category": 1}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Similarity.objects.count(), 0)
+
+    def test_similar_within_depth(self):
+        for first, second in [(1, 2), (2, 3), (3, 4)]:
+            Similarity.objects.create(first_id=first, second_id=second)
+        response = self.client.get("/categories/1/similar/?depth=2&fields=name")
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"id": 2, "name": "ябълки", "distance": 1},
+                {"id": 3, "name": "круши", "distance": 2},
+            ],
+        )
+        Similarity.objects.create(first_id=1, second_id=4)
+        response = self.client.get("/categories/1/similar/?depth=2")
+        distances = [(r["id"], r["distance"]) for r in response.json()["results"]]
+        self.assertEqual(distances, [(2, 1), (3, 2), (4, 1)])
+        response = self.client.get("/categories/5/similar/?depth=3")
+        self.assertEqual(response.json()["results"], [])
+
+    def test_similarity_path(self):
+        for first, second in [(1, 2), (2, 3), (3, 4), (1, 5)]:
+            Similarity.objects.create(first_id=first, second_id=second)
+        response = self.client.get("/categories/4/path/5/?fields=name")
+        path = [record["id"] for record in response.json()["path"]]
+        self.assertEqual(path, [4, 3, 2, 1, 5])
+        Similarity.objects.filter(first_id=1, second_id=5).delete()
+        response = self.client.get("/categories/4/path/5/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/categories/4/path/9/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkTest(APITestCase):
+    def setUp(self):
+        Category.objects.create(name="плодове", description="text")
+
+    def test_bulk_create(self):
+        data = [
+            {"key": "c", "name": "ябълки", "description": "text", "parent_key": "b"},
+            {"key": "b", "name": "круши", "description": "text", "parent": 1},
+            {"name": "малини", "description": "text", "parent_key": "c"},
+            {"name": "ягоди", "description": "text"},
+        ]
+        response = self.client.post("/categories/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = json.loads(response.getvalue())["ids"]
+        self.assertEqual(Category.objects.count(), 5)
+        apple = Category.objects.get(pk=ids["c"])
+        self.assertEqual(apple.parent_id, ids["b"])
+        self.assertEqual(apple.path, "1/{}/".format(ids["b"]))
+        raspberry = Category.objects.get(name="малини")
+        self.assertEqual(raspberry.depth, 3)
+        response = self.client.get("/categories/1/descendants/")
+        self.assertEqual(len(json.loads(response.getvalue())["results"]), 4)
+
+    def test_bulk_create_rejects_cycles(self):
+        data = [
+            {"key": "a", "name": "ябълки", "description": "text", "parent_key": "b"},
+            {"key": "b", "name": "круши", "description": "text", "parent_key": "a"},
+        ]
+        response = self.client.post("/categories/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_bulk_create_rejects_unknown_parent(self):
+        data = [{"name": "ябълки", "description": "text", "parent": 42}]
+        response = self.client.post("/categories/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update(self):
+        Category.objects.create(name="ябълки", description="text")
+        Category.objects.create(name="круши", description="text", parent_id=2)
+        data = [
+            {"id": 1, "description": "сочни"},
+            {"id": 2, "name": "дюли", "parent": 1},
+        ]
+        response = self.client.patch("/categories/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Category.objects.get(pk=1).description, "сочни")
+        self.assertEqual(Category.objects.get(pk=2).name, "дюли")
+        self.assertEqual(Category.objects.get(pk=3).path, "1/2/")
+
+    def test_patch_category(self):
+        response = self.client.patch(
+            "/categories/1/", {"description": "сочни"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Category.objects.get(pk=1).description, "сочни")
+
+
+class AsyncViewsTest(APITestCase):
+    def setUp(self):
+        fruit = Category.objects.create(name="плодове", description="text")
+        apples = Category.objects.create(name="ябълки", description="text", parent=fruit)
+        Category.objects.create(name="круши", description="text", parent=fruit)
+        Category.objects.create(name="айвър", description="text", parent=apples)
+        Similarity.objects.create(first=fruit, second=apples)
+
+    def assertSameAsSync(self, path):
+        response = self.client.get("/async" + path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = json.loads(self.client.get(path).getvalue())
+        # Pagination links point back at the async endpoints
+        content = response.getvalue().decode().replace("/async/", "/")
+        self.assertEqual(json.loads(content), expected)
+        return response
+
+    def test_same_as_sync(self):
+        self.assertSameAsSync("/categories/")
+        self.assertSameAsSync("/categories/2/")
+        self.assertSameAsSync("/categories/1/similar/")
+        for query_type in ("subcategories", "siblings", "leaves", "descendants"):
+            self.assertSameAsSync("/categories/2/{}/".format(query_type))
+
+    def test_pagination(self):
+        response = self.assertSameAsSync("/categories/1/descendants/?page_size=3")
+        page = json.loads(response.getvalue())
+        next_page = json.loads(self.client.get(page["next"]).getvalue())
+        self.assertEqual([c["id"] for c in next_page["results"]], [4])
+        previous = json.loads(self.client.get(next_page["previous"]).getvalue())
+        self.assertEqual([c["id"] for c in previous["results"]], [1, 2, 3])
+
+    def test_not_modified(self):
+        etag = self.client.get("/async/categories/1/")["ETag"]
+        response = self.client.get("/async/categories/1/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_errors(self):
+        for path in [
+            "/categories/42/",
+            "/categories/42/subcategories/",
+            "/categories/?cursor=zzz",
+        ]:
+            response = self.client.get("/async" + path)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.get(path).status_code, response.status_code)
+        response = self.client.get("/async/categories/1/sfweggr/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # The sync view lists no similarities rather than answering 404
+        self.assertSameAsSync("/categories/42/similar/")
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        first = Category.objects.create(name="банани", description="Еквадор")
+        second = Category.objects.create(name="круши", description="", parent=first)
+        Similarity.objects.create(first=first, second=second)
+
+    def test_export_lines(self):
+        response = self.client.get("/export/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(
+            records[0],
+            {
+                "type": "category",
+                "id": 1,
+                "name": "банани",
+                "description": "Еквадор",
+                "image": None,
+                "image_variants": {},
+                "parent": None,
+            },
+        )
+        self.assertEqual(records[1]["parent"], 1)
+        self.assertEqual(records[2], {"type": "similarity", "first": 1, "second": 2})
+
+    def test_export_gzipped_array(self):
+        response = self.client.get("/export/?as=array", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = gzip.decompress(b"".join(response.streaming_content))
+        self.assertEqual(len(json.loads(content)), 3)
+
+    def test_etag_depends_on_encoding(self):
+        plain = self.client.get("/export/")["ETag"]
+        gzipped = self.client.get("/export/", HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        self.assertNotEqual(plain, gzipped)
+        response = self.client.get(
+            "/export/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=plain
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        Category.objects.create(name="банани", description="Еквадор")
+
+    def test_not_modified(self):
+        response = self.client.get("/categories/")
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        with self.assertNumQueries(1):
+            response = self.client.get("/categories/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_write_changes_etag(self):
+        etag = self.client.get("/categories/1/")["ETag"]
+        self.client.put(
+            "/categories/1/", {"name": "круши", "description": "Кичево"}, format="json"
+        )
+        response = self.client.get("/categories/1/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_depends_on_query(self):
+        first = self.client.get("/categories/")["ETag"]
+        second = self.client.get("/categories/?page_size=1")["ETag"]
+        self.assertNotEqual(first, second)
+
+    def test_similarity_write_changes_etag(self):
+        etag = self.client.get("/similarity/")["ETag"]
+        Category.objects.create(name="круши", description="")
+        self.assertEqual(self.client.get("/similarity/")["ETag"], etag)
+        self.client.post("/similarity/", {"first": 1, "second": 2}, format="json")
+        self.assertNotEqual(self.client.get("/similarity/")["ETag"], etag)
+
+
+class IslandTest(APITestCase):
+    def setUp(self):
+        for name in ["банани", "ябълки", "круши", "ягоди", "малини", "сливи"]:
+            Category.objects.create(name=name, description="")
+
+    def islands(self):
+        graph = Graph.from_database()
+        expected = {
+            frozenset(graph.ids[i] for i in component)
+            for component in graph.components()
+        }
+        stored = {}
+        for pk, island in Category.objects.values_list("id", "island"):
+            stored.setdefault(pk if island is None else island, set()).add(pk)
+        self.assertEqual({frozenset(c) for c in stored.values()}, expected)
+        return sorted(sorted(c) for c in expected)
+
+    def test_island_endpoints(self):
+        for first, second in [(1, 2), (3, 4), (2, 3)]:
+            self.client.post("/similarity/", {"first": first, "second": second})
+        response = self.client.get("/categories/4/island/")
+        self.assertEqual(response.json()["size"], 4)
+        self.assertEqual(
+            self.client.get("/categories/6/island/").json(), {"island": 6, "size": 1}
+        )
+        self.client.patch("/categories/2/similar/", {"category": 3}, format="json")
+        response = self.client.get("/islands/")
+        self.assertEqual(
+            [island["size"] for island in response.json()["results"]], [2, 2]
+        )
+        self.assertEqual(self.islands(), [[1, 2], [3, 4], [5], [6]])
+        response = self.client.get("/categories/9/island/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_random_changes(self):
+        rng = random.Random(7)
+        for _ in range(60):
+            first, second = rng.sample(range(1, 7), 2)
+            similarity = Similarity.between(first, second)
+            if similarity.exists():
+                similarity.delete()
+            else:
+                Similarity.objects.create(first_id=first, second_id=second)
+            self.islands()
+        Category.objects.get(pk=rng.randint(1, 6)).delete()
+        self.islands()
+
+
+class FieldsTest(APITestCase):
+    def setUp(self):
+        Category.objects.create(name="плодове", description="сочни")
+        Category.objects.create(name="ябълки", description="", parent_id=1)
+
+    def test_list_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/categories/?fields=name,parent")
+        self.assertEqual(
+            response.json()["results"][1], {"id": 2, "name": "ябълки", "parent": 1}
+        )
+        self.assertNotIn("description", queries[-1]["sql"])
+        response = self.client.get("/categories/1/subcategories/?fields=name")
+        self.assertEqual(response.json()["results"], [{"id": 2, "name": "ябълки"}])
+
+    def test_detail_exclude(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/categories/1/?exclude=description,image,image_variants"
+            )
+        self.assertEqual(response.json(), {"id": 1, "name": "плодове", "parent": None})
+        self.assertNotIn("description", queries[-1]["sql"])
+        response = self.client.get("/categories/1/tree/?fields=name")
+        self.assertEqual(
+            response.json(),
+            {
+                "id": 1,
+                "name": "плодове",
+                "children": [{"id": 2, "name": "ябълки", "children": []}],
+            },
+        )
+        response = self.client.get("/async/categories/2/?fields=parent")
+        self.assertEqual(response.json(), {"id": 2, "parent": 1})
+
+    def test_unknown_field(self):
+        response = self.client.get("/categories/?fields=name,colour")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/async/categories/?exclude=colour")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TreeCountsTest(APITestCase):
+    def setUp(self):
+        fruit = Category.objects.create(name="плодове", description="")
+        apples = Category.objects.create(name="ябълки", description="", parent=fruit)
+        Category.objects.create(name="айдаред", description="", parent=apples)
+        Category.objects.create(name="круши", description="", parent=fruit)
+        Category.objects.create(name="зеленчуци", description="")
+
+    def counts(self):
+        self.assertEqual(aggregates.rebuild(fix=False), [])
+        rows = Category.objects.values_list(
+            "id", "child_count", "descendant_count", "leaf_count"
+        )
+        return {pk: tuple(counts) for pk, *counts in rows}
+
+    def test_counts_follow_changes(self):
+        self.assertEqual(
+            self.counts(),
+            {1: (2, 3, 2), 2: (1, 1, 1), 3: (0, 0, 1), 4: (0, 0, 1), 5: (0, 0, 1)},
+        )
+        self.client.post("/categories/2/move/", {"parent": 5}, format="json")
+        self.assertEqual(self.counts()[1], (1, 1, 1))
+        self.assertEqual(self.counts()[5], (1, 2, 1))
+        self.client.patch("/categories/bulk/", [{"id": 4, "parent": 3}], format="json")
+        self.assertEqual(self.counts()[5], (1, 3, 1))
+        self.client.post(
+            "/categories/bulk/",
+            [
+                {"key": "a", "name": "сливи", "description": "-", "parent": 1},
+                {"name": "джанки", "description": "-", "parent_key": "a"},
+                {"name": "ренглоти", "description": "-", "parent_key": "a"},
+            ],
+            format="json",
+        )
+        self.assertEqual(self.counts()[1], (1, 3, 2))
+        self.client.delete("/categories/2/")
+        self.assertEqual(self.counts()[5], (0, 0, 1))
+        Category.objects.get(pk=6).delete()
+        self.assertEqual(self.counts(), {1: (0, 0, 1), 5: (0, 0, 1)})
+
+    def test_optional_fields(self):
+        response = self.client.get("/categories/1/")
+        self.assertNotIn("leaf_count", response.json())
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/categories/1/?fields=depth,child_count,descendant_count,leaf_count"
+            )
+        self.assertEqual(
+            response.json(),
+            {
+                "id": 1,
+                "depth": 0,
+                "child_count": 2,
+                "descendant_count": 3,
+                "leaf_count": 2,
+            },
+        )
+        response = self.client.get("/categories/2/subcategories/?fields=depth")
+        self.assertEqual(response.json()["results"], [{"id": 3, "depth": 2}])
+
+    def test_rebuild_command(self):
+        Category.objects.filter(pk=1).update(descendant_count=7, depth=3)
+        with self.assertRaises(management.CommandError):
+            management.call_command("rebuild_tree", "--verify", stdout=StringIO())
+        out = StringIO()
+        management.call_command("rebuild_tree", stdout=out)
+        self.assertIn("fixed 1", out.getvalue())
+        self.assertEqual(self.counts()[1], (2, 3, 2))
+
+
+class SearchTest(APITestCase):
+    def setUp(self):
+        Category.objects.create(name="Ябълки", description="сочни плодове")
+        Category.objects.create(name="Круши", description="по-сочни от ябълки")
+        Category.objects.create(name="Ябълков пай", description="сладкиш")
+        Category.objects.create(name="Café", description="")
+
+    def search(self, query):
+        response = self.client.get("/categories/search/", {"q": query})
+        return [record["id"] for record in response.json()["results"]]
+
+    def test_ranking(self):
+        # Name matches rank above description matches
+        self.assertEqual(self.search("ябълки"), [1, 2])
+        self.assertEqual(self.search("сочни ПЛОДОВЕ"), [1])
+        self.assertEqual(self.search("cafe"), [4])
+        response = self.client.get(
+            "/categories/search/", {"q": "ябълк", "autocomplete": "1", "fields": "name"}
+        )
+        self.assertEqual(
+            response.json()["results"],
+            [{"id": 1, "name": "Ябълки"}, {"id": 3, "name": "Ябълков пай"}],
+        )
+        response = self.client.get(
+            "/categories/search/", {"q": "ябълков п", "autocomplete": "1"}
+        )
+        self.assertEqual([record["id"] for record in response.json()["results"]], [3])
+
+    def test_index_follows_changes(self):
+        self.client.patch("/categories/2/", {"name": "Сливи"}, format="json")
+        self.assertEqual(self.search("сливи"), [2])
+        self.assertEqual(self.search("круши"), [])
+        self.client.delete("/categories/1/")
+        self.assertEqual(self.search("плодове"), [])
+        Category.objects.bulk_create([Category(name="Ябълки", description="")])
+        self.assertEqual(self.search("ябълки"), [5, 2])
+
+    def test_invalid_query(self):
+        for params in [{}, {"q": " \"*"}, {"q": "ябълки", "limit": "0"}]:
+            response = self.client.get("/categories/search/", params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchLookupTest(APITestCase):
+    def setUp(self):
+        fruit = Category.objects.create(name="плодове", description="пресни")
+        for name in ["ябълки", "круши", "сливи"]:
+            Category.objects.create(name=name, description="сочни", parent=fruit)
+        Similarity.objects.create(first_id=2, second_id=3)
+        Similarity.objects.create(first_id=3, second_id=4)
+
+    def test_ids(self):
+        params = {"ids": "3,1,3,99", "fields": "name"}
+        with self.assertNumQueries(2):
+            response = self.client.get("/categories/", params)
+        self.assertEqual(
+            response.json(),
+            {"results": [{"id": 3, "name": "круши"}, {"id": 1, "name": "плодове"}]},
+        )
+        for ids in ["1,x", "", ",".join(map(str, range(1, 102)))]:
+            response = self.client.get("/categories/", {"ids": ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch(self):
+        queries = [
+            {"id": 2, "type": "category"},
+            {"id": 2, "type": "siblings", "limit": 2},
+            {"id": 2, "type": "similar", "depth": 2},
+            {"id": 99, "type": "leaves"},
+        ]
+        url = "/categories/batch/?fields=name"
+        self.client.post(url, queries, format="json")
+        # The tree and graph are cached, one query for the versions, one for rows
+        with self.assertNumQueries(2):
+            response = self.client.post(url, queries, format="json")
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "id": 2,
+                    "type": "category",
+                    "results": [{"id": 2, "name": "ябълки"}],
+                    "has_more": False,
+                },
+                {
+                    "id": 2,
+                    "type": "siblings",
+                    "results": [
+                        {"id": 2, "name": "ябълки"},
+                        {"id": 3, "name": "круши"},
+                    ],
+                    "has_more": True,
+                },
+                {
+                    "id": 2,
+                    "type": "similar",
+                    "results": [
+                        {"id": 3, "name": "круши", "distance": 1},
+                        {"id": 4, "name": "сливи", "distance": 2},
+                    ],
+                    "has_more": False,
+                },
+                {"id": 99, "type": "leaves", "detail": "Not found."},
+            ],
+        )
+
+    @override_settings(CATEGORIES_TREE_CACHE=False)
+    def test_batch_from_database(self):
+        queries = [{"id": 1, "type": "leaves"}, {"id": 2, "type": "subcategories"}]
+        response = self.client.post("/categories/batch/", queries, format="json")
+        results = response.json()["results"]
+        self.assertEqual([r["id"] for r in results[0]["results"]], [2, 3, 4])
+        self.assertEqual(results[1]["results"], [])
+
+    def test_invalid_batch(self):
+        for queries in [{"id": 1}, [{"id": 1, "type": "cousins"}], [{"id": 1}] * 101]:
+            response = self.client.post("/categories/batch/", queries, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RenderingTest(APITestCase):
+    def test_list_matches_serializer(self):
+        Category.objects.create(
+            name="банани\u2028",
+            description="Еквадор",
+            image="images/ab/ab.png",
+            image_variants={"thumbnail": {"jpeg": "images/variants/ab/thumbnail.jpg"}},
+        )
+        Category.objects.create(name="круши", description="", parent_id=1)
+        request = Request(APIRequestFactory().get("/categories/"))
+        data = CategorySerializer(
+            Category.objects.order_by("id"), many=True, context={"request": request}
+        ).data
+        expected = JSONRenderer().render(
+            {"next": None, "previous": None, "results": data}
+        )
+        self.assertEqual(self.client.get("/categories/").content, expected)
+        expected = JSONRenderer().render(
+            {"next": None, "previous": None, "results": data[1:]}
+        )
+        response = self.client.get("/categories/1/subcategories/")
+        self.assertEqual(response.content, expected)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "name": "ягоди\u2028\u2029",
+            "price": Decimal("1.50"),
+            "updated": datetime.datetime(2024, 3, 1, 12, 0, 0, 123456),
+            "nested": [{"id": 1, "parent": None}, True, 2.5],
+            "lazy": gettext_lazy("Not found."),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+        # Floats keep their value, but not always their formatting
+        floats = [1e16, 1e-7, 0.00001, 2.5]
+        self.assertEqual(
+            json.loads(FastJSONRenderer().render(floats)),
+            json.loads(JSONRenderer().render(floats)),
+        )
+
+
+@modify_settings(
+    MIDDLEWARE={"append": "categories.middleware.RequestTimingMiddleware"}
+)
+class RequestTimingTest(APITestCase):
+    def setUp(self):
+        Category.objects.create(name="банани", description="Еквадор")
+
+    def test_server_timing(self):
+        with self.assertLogs("categories.middleware", "INFO") as logs:
+            response = self.client.get("/categories/")
+        timing = response["Server-Timing"]
+        self.assertIn("db;dur=", timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn("serialize;dur=", timing)
+        self.assertIn("render;dur=", timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], "/categories/")
+        self.assertEqual(record["queries"], 2)
+        self.assertNotIn("repeated_queries", record)
+
+    @override_settings(CATEGORIES_REPEATED_QUERY_THRESHOLD=2)
+    def test_repeated_queries(self):
+        Category.objects.create(name="круши", description="Кичево")
+        with self.assertLogs("categories.middleware", "WARNING") as logs:
+            self.client.patch(
+                "/categories/bulk/",
+                [{"id": 1, "parent": 2}, {"id": 2, "parent": None}],
+                format="json",
+            )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreaterEqual(record["repeated_queries"][0]["count"], 2)
+
 
 class RabbitHoleTests(TestCase):
     def setUp(self):
@@ -229,3 +1096,231 @@ class RabbitHoleTests(TestCase):
             out.getvalue(),
             "Longest rabbit hole: [3, 2, 1]\nRabbit islands: {(1, 2, 3), (4,), (5,)}\n",
         )
+
+    def test_command_json(self):
+        out = StringIO()
+        management.call_command("rabbit_hole", "--json", "--top-k", "1", stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["longest_rabbit_hole"], [3, 2, 1])
+        self.assertEqual(
+            result["islands"],
+            [{"size": 3, "categories": [1, 2, 3], "longest_rabbit_hole": [3, 2, 1]}],
+        )
+        for top_k in ["0", "-1"]:
+            with self.assertRaises(management.CommandError):
+                management.call_command("rabbit_hole", "--top-k", top_k, stdout=out)
+
+    def test_command_workers(self):
+        Similarity.objects.create(
+            first=Category.objects.get(pk=4), second=Category.objects.get(pk=5)
+        )
+        out = StringIO()
+        management.call_command(
+            "rabbit_hole", "--json", "--workers", "2", stdout=out
+        )
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["longest_rabbit_hole"], [3, 2, 1])
+        islands = [island["categories"] for island in result["islands"]]
+        self.assertEqual(islands, [[1, 2, 3], [4, 5]])
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        fruit = Category.objects.create(name="плодове", description="")
+        for name in ["ябълки", "круши", "сливи"]:
+            Category.objects.create(name=name, description="", parent=fruit)
+        Category.objects.create(name="айдаред", description="", parent_id=2)
+        for first, second in [(2, 3), (3, 4), (4, 5)]:
+            Similarity.objects.create(first_id=first, second_id=second)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_round_trip(self):
+        out = StringIO()
+        management.call_command("snapshot", self.path, stdout=out)
+        self.assertIn("5 categories and 3 similarities", out.getvalue())
+        mapped = snapshot.load(self.path)
+        self.assertEqual(mapped.parent_id(5), 2)
+        graph = Graph.from_database()
+        for loaded in [
+            Graph.from_snapshot(mapped),
+            pickle.loads(pickle.dumps(Graph.from_snapshot(mapped))),
+        ]:
+            self.assertEqual(list(loaded.ids), list(graph.ids))
+            self.assertEqual(
+                [list(loaded.neighbours(i)) for i in range(len(loaded))],
+                [list(graph.neighbours(i)) for i in range(len(graph))],
+            )
+        tree = tree_cache.TreeSnapshot.from_snapshot(mapped)
+        self.assertEqual(tree.descendants(2), [2, 5])
+        self.assertEqual(tree.siblings(3), [2, 3, 4])
+        self.assertNotIn(6, tree)
+
+        from_database = StringIO()
+        management.call_command("rabbit_hole", "--json", stdout=from_database)
+        from_file = StringIO()
+        management.call_command(
+            "rabbit_hole", "--json", "--snapshot", self.path, stdout=from_file
+        )
+        result = json.loads(from_file.getvalue())
+        self.assertEqual(result["longest_rabbit_hole"], [5, 4, 3, 2])
+        self.assertEqual(
+            result["islands"], json.loads(from_database.getvalue())["islands"]
+        )
+
+    def test_tree_cache(self):
+        snapshot.write(self.path)
+        tree_cache.invalidate()
+        with override_settings(CATEGORIES_SNAPSHOT=self.path):
+            with self.assertNumQueries(1):
+                self.assertEqual(tree_cache.get_snapshot().leaves(1), [3, 4, 5])
+            self.assertIsInstance(tree_cache.get_snapshot().ids, memoryview)
+            # Out of date after any change, read from the database again
+            Category.objects.create(name="праскови", description="", parent_id=1)
+            self.assertEqual(tree_cache.get_snapshot().leaves(1), [3, 4, 5, 6])
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot")
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(self.path)
+        with self.assertRaises(management.CommandError):
+            management.call_command("rabbit_hole", "--snapshot", self.path)
+        snapshot.write(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(100)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(self.path)
+
+
+class LoadCatalogueTests(TestCase):
+    def _write(self, suffix, content):
+        f = tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False)
+        self.addCleanup(os.remove, f.name)
+        with f:
+            f.write(content)
+        return f.name
+
+    def test_load_catalogue(self):
+        categories = self._write(
+            ".ndjson",
+            '{"id": 3, "name": "малини", "description": "", "parent": 2}\n'
+            '{"id": 2, "name": "ябълки", "description": "", "parent": 1}\n'
+            '{"id": 1, "name": "плодове", "description": "сочни", "parent": null}\n',
+        )
+        similarities = self._write(".csv", "first,second\n3,1\n1,3\n2,3\n")
+        out = StringIO()
+        management.call_command(
+            "load_catalogue",
+            "--categories",
+            categories,
+            "--similarities",
+            similarities,
+            "--batch-size",
+            "2",
+            stdout=out,
+        )
+        self.assertIn("categories: 3 rows", out.getvalue())
+        self.assertIn("similarities: 2 rows", out.getvalue())
+        self.assertIn("similarities: 1 duplicates skipped", out.getvalue())
+        self.assertEqual(Category.objects.get(pk=3).path, "1/2/")
+        self.assertEqual(
+            list(
+                Similarity.objects.order_by("first", "second").values_list(
+                    "first", "second"
+                )
+            ),
+            [(1, 3), (2, 3)],
+        )
+        self.assertEqual(
+            list(Category.objects.order_by("id").values_list("island", flat=True)),
+            [1, 1, 1],
+        )
+
+    def test_load_catalogue_rejects_cycles(self):
+        categories = self._write(
+            ".csv", "id,name,description,parent\n1,плодове,,2\n2,ябълки,,1\n"
+        )
+        with self.assertRaises(management.CommandError):
+            management.call_command("load_catalogue", "--categories", categories)
+        self.assertEqual(Category.objects.count(), 0)
+
+
+class SQLiteSettingsTest(TestCase):
+    def connect(self, **pragmas):
+        fd, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        default = connections["default"]
+        database = type(default)({**default.settings_dict, "NAME": path})
+        self.addCleanup(database.close)
+        pragmas = {**settings.CATEGORIES_SQLITE_PRAGMAS, **pragmas}
+        with override_settings(CATEGORIES_SQLITE_PRAGMAS=pragmas):
+            database.ensure_connection()
+        return database.connection
+
+    def test_pragmas(self):
+        database = self.connect(cache_size=-1000)
+        values = {
+            name: database.execute("PRAGMA {}".format(name)).fetchone()[0]
+            for name in ["journal_mode", "synchronous", "busy_timeout", "cache_size"]
+        }
+        self.assertEqual(
+            values,
+            {
+                "journal_mode": "wal",
+                "synchronous": 1,
+                "busy_timeout": 5000,
+                "cache_size": -1000,
+            },
+        )
+
+    def test_invalid_pragma(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.connect(journal_mode="wal; PRAGMA foreign_keys = 0")
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark(self):
+        Category.objects.create(name="плодове", description="сочни")
+        f = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        management.call_command(
+            "benchmark",
+            "--in-transaction",
+            "--size",
+            "30",
+            "--depth",
+            "5",
+            "--requests",
+            "2",
+            "--shape",
+            "chain",
+            "--graph",
+            "sparse",
+            "--output",
+            f.name,
+            stdout=StringIO(),
+        )
+        with open(f.name) as output:
+            report = json.load(output)
+        targets = {result["target"] for result in report["results"]}
+        self.assertIn("GET /categories/{id}/leaves/", targets)
+        self.assertIn("GET /categories/?ids={ids}", targets)
+        self.assertIn("POST /categories/batch/", targets)
+        self.assertIn("rabbit_hole --approximate", targets)
+        listing = report["results"][0]
+        self.assertEqual(listing["dataset"], "chain/sparse")
+        self.assertGreater(listing["queries_mean"], 0)
+        self.assertLessEqual(listing["p50_ms"], listing["p99_ms"])
+
+        # The generated catalogue is rolled back
+        self.assertEqual(Category.objects.get().name, "плодове")
+
+    def test_concurrency_needs_committed_data(self):
+        with self.assertRaises(management.CommandError):
+            management.call_command(
+                "benchmark", "--in-transaction", "--concurrency", "2", stdout=StringIO()
+            )
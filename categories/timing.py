@@ -0,0 +1,78 @@
+"""Per-request timings collected by ``RequestTimingMiddleware``.
+
+The timings of the request being handled are kept in a context variable, so
+code deep inside a view, such as a serializer, can add to them without the
+request being passed along. Nothing is recorded when the middleware is off.
+"""
+
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar("categories_request_timings", default=None)
+
+# Lists of placeholders differ only in the number of values, e.g. id__in
+_PLACEHOLDERS = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = Counter()
+        self.queries = 0
+        self.statements = Counter()
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+
+    def execute(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook counting and timing queries."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add("db", time.perf_counter() - started)
+            self.queries += 1
+            self.statements[_PLACEHOLDERS.sub("(...)", sql)] += 1
+
+    def repeated(self, threshold):
+        """SQL statements run at least ``threshold`` times, most frequent first.
+
+        The same statement with different parameters over and over is what a
+        query per result row looks like.
+        """
+        return [
+            (sql, count)
+            for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def measure(name):
+    """Add the time spent in the block to ``name`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
@@ -0,0 +1,144 @@
+import logging
+from array import array
+
+from django.conf import settings
+
+from categories.models import Category, Version
+
+
+logger = logging.getLogger(__name__)
+
+
+class TreeSnapshot:
+    """In-memory copy of the category tree structure.
+
+    Stored as parent, first-child and next-sibling arrays indexed by the
+    position of each id in ``ids``; -1 marks a missing link. Children are
+    linked in id order, and roots are chained from ``first_root``.
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.ids = array("q")
+        parent_ids = []
+        for pk, parent_id in rows:
+            self.ids.append(pk)
+            parent_ids.append(parent_id)
+        self.index = {pk: i for i, pk in enumerate(self.ids)}
+
+        n = len(self.ids)
+        self.parent = array("q", [-1]) * n
+        self.first_child = array("q", [-1]) * n
+        self.next_sibling = array("q", [-1]) * n
+        self.first_root = -1
+        # Walking backwards and prepending leaves every chain in id order
+        for i in range(n - 1, -1, -1):
+            if parent_ids[i] is None:
+                self.next_sibling[i] = self.first_root
+                self.first_root = i
+            else:
+                parent = self.index[parent_ids[i]]
+                self.parent[i] = parent
+                self.next_sibling[i] = self.first_child[parent]
+                self.first_child[parent] = i
+
+    @classmethod
+    def from_database(cls, version):
+        rows = Category.objects.order_by("id").values_list("id", "parent_id")
+        return cls(rows.iterator(chunk_size=10000), version)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Use the arrays of a ``categories.snapshot`` as they are."""
+        tree = cls.__new__(cls)
+        tree.version = snapshot.category_version
+        tree.ids = snapshot.ids
+        tree.index = snapshot.index
+        tree.parent = snapshot.parent
+        tree.first_child = snapshot.first_child
+        tree.next_sibling = snapshot.next_sibling
+        tree.first_root = snapshot.first_root
+        return tree
+
+    def __contains__(self, pk):
+        return pk in self.index
+
+    def _chain(self, position):
+        result = []
+        while position != -1:
+            result.append(position)
+            position = self.next_sibling[position]
+        return result
+
+    def _subtree(self, position):
+        result = []
+        stack = [position]
+        while stack:
+            current = stack.pop()
+            result.append(current)
+            stack.extend(self._chain(self.first_child[current]))
+        return result
+
+    def _ids(self, positions):
+        return [self.ids[i] for i in sorted(positions)]
+
+    def subcategories(self, pk):
+        return self._ids(self._chain(self.first_child[self.index[pk]]))
+
+    def siblings(self, pk):
+        parent = self.parent[self.index[pk]]
+        first = self.first_root if parent == -1 else self.first_child[parent]
+        return self._ids(self._chain(first))
+
+    def descendants(self, pk):
+        return self._ids(self._subtree(self.index[pk]))
+
+    def leaves(self, pk):
+        subtree = self._subtree(self.index[pk])
+        return self._ids(i for i in subtree if self.first_child[i] == -1)
+
+
+_snapshot = None
+
+
+def get_snapshot(version=None):
+    """Return a snapshot matching the current tree version.
+
+    Costs one query for the version check, unless the caller already read the
+    version, plus one more to rebuild the snapshot when another process or
+    thread has changed the tree.
+    """
+    global _snapshot
+    if version is None:
+        version = Version.current("category")
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        snapshot = _from_file(version) or TreeSnapshot.from_database(version)
+        _snapshot = snapshot
+    return snapshot
+
+
+def _from_file(version):
+    """Map the tree from ``CATEGORIES_SNAPSHOT`` when it is at ``version``."""
+    if not settings.CATEGORIES_SNAPSHOT:
+        return None
+    # categories.snapshot builds on this module
+    from categories.snapshot import Snapshot, SnapshotError
+
+    try:
+        snapshot = Snapshot(settings.CATEGORIES_SNAPSHOT)
+    except FileNotFoundError:
+        return None
+    except (OSError, SnapshotError):
+        logger.warning(
+            "Can't load the tree from %s", settings.CATEGORIES_SNAPSHOT, exc_info=True
+        )
+        return None
+    if snapshot.category_version != version:
+        return None
+    return TreeSnapshot.from_snapshot(snapshot)
+
+
+def invalidate():
+    global _snapshot
+    _snapshot = None
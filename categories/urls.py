@@ -5,11 +5,20 @@ from categories import views
 
 urlpatterns = [
     path("categories/", views.CategoryList.as_view()),
+    path("categories/bulk/", views.CategoryBulk.as_view()),
+    path("categories/batch/", views.CategoryBatch.as_view()),
+    path("categories/search/", views.CategorySearch.as_view()),
     path("categories/<int:pk>/", views.CategoryDetail.as_view()),
     path("categories/<int:pk>/upload/", views.ImageUploadView.as_view()),
+    path("categories/<int:pk>/move/", views.CategoryMove.as_view()),
     path("categories/<int:pk>/similar/", views.SimilarityDetail.as_view()),
+    path("categories/<int:pk>/tree/", views.CategorySubtree.as_view()),
+    path("categories/<int:pk>/island/", views.CategoryIsland.as_view()),
+    path("categories/<int:pk>/path/<int:other>/", views.SimilarityPath.as_view()),
     path("categories/<int:pk>/<type>/", views.CategoryTreeListing.as_view()),
     path("similarity/", views.SimilarityList.as_view()),
+    path("islands/", views.IslandList.as_view()),
+    path("export/", views.CatalogueExport.as_view()),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -1,30 +1,173 @@
+import json
+
 from rest_framework import mixins
 from rest_framework import generics
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework.exceptions import ValidationError
-from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils.text import compress_sequence
+
+from categories import bulk, graph_cache, images, islands, search, tree_cache
+from categories.conditional import catalogue_condition
+from categories.models import Category, CycleError, Similarity, Version
+from categories.pagination import IslandCursorPagination
+from categories.serializers import (
+    BatchQuerySerializer,
+    BulkCategorySerializer,
+    BulkCategoryUpdateSerializer,
+    CategoryMoveSerializer,
+    CategorySerializer,
+    SimilaritySerializer,
+    category_columns,
+    category_fields,
+    category_records,
+    image_url,
+    image_url_prefix,
+    image_variant_urls,
+)
+
+
+class CategoryRecordsMixin:
+    """List categories from ``values()`` rows instead of model instances.
 
-from categories.models import Category, Similarity
-from categories.serializers import CategorySerializer, SimilaritySerializer
+    Only the columns of the fields picked with ``?fields=`` and ``?exclude=``
+    are read.
+    """
+
+    def list_records(self, rows):
+        fields = category_fields(self.request.query_params)
+        rows = rows.values(*category_columns(fields))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                category_records(page, self.request, fields)
+            )
+        return Response(category_records(rows, self.request, fields))
+
+    def records_for_ids(self, ids):
+        """Records of the categories ``ids`` that exist, in that order."""
+        fields = category_fields(self.request.query_params)
+        columns = category_columns(fields)
+        # Batched like in_bulk, SQLite limits the number of query parameters
+        batch_size = connection.features.max_query_params or len(ids) or 1
+        rows = {}
+        for start in range(0, len(ids), batch_size):
+            batch = Category.objects.filter(id__in=ids[start : start + batch_size])
+            rows.update((row["id"], row) for row in batch.values(*columns))
+        return category_records(
+            (rows[pk] for pk in ids if pk in rows), self.request, fields
+        )
 
+    def list_ids(self, ids, distances=None):
+        """List the categories of a sorted list of ids, a page at a time.
 
+        Only the rows of the returned page are read from the database.
+        """
+        page = None
+        if self.paginator is not None:
+            page = self.paginator.paginate_ids(ids, self.request, view=self)
+        if page is not None:
+            ids = page
+        records = self.records_for_ids(ids)
+        if distances is not None:
+            for record in records:
+                record["distance"] = distances[record["id"]]
+        if page is not None:
+            return self.get_paginated_response(records)
+        return Response(records)
+
+
+class DepthParamMixin:
+    def get_depth(self):
+        depth = self.request.query_params.get("depth")
+        if depth is None:
+            return None
+        if not depth.isdigit():
+            raise ValidationError(
+                {"Invalid depth": "{} is not a non-negative integer".format(depth)}
+            )
+        return int(depth)
+
+
+@method_decorator(catalogue_condition("category"), name="get")
 class CategoryList(
-    mixins.ListModelMixin, mixins.CreateModelMixin, generics.GenericAPIView
+    CategoryRecordsMixin, mixins.CreateModelMixin, generics.GenericAPIView
 ):
 
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    max_ids = 100
+
+    def get_ids(self):
+        """Ids picked with ``?ids=``, without duplicates, or None."""
+        if "ids" not in self.request.query_params:
+            return None
+        values = self.request.query_params["ids"].split(",")
+        for value in values:
+            if not value.isdigit():
+                raise ValidationError(
+                    {"Invalid ids": "{} is not a category id".format(value)}
+                )
+        ids = list(dict.fromkeys(map(int, values)))
+        if len(ids) > self.max_ids:
+            raise ValidationError(
+                {"Invalid ids": "At most {} categories".format(self.max_ids)}
+            )
+        return ids
 
     def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)
+        ids = self.get_ids()
+        if ids is not None:
+            # Unknown ids are left out, the rest keep the order they were given
+            return Response({"results": self.records_for_ids(ids)})
+        return self.list_records(self.filter_queryset(self.get_queryset()))
 
     def post(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
 
+@method_decorator(catalogue_condition("category"), name="get")
+class CategorySearch(CategoryRecordsMixin, generics.GenericAPIView):
+    queryset = Category.objects.all()
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self):
+        limit = self.request.query_params.get("limit")
+        if limit is None:
+            return self.default_limit
+        if not limit.isdigit() or int(limit) == 0:
+            raise ValidationError(
+                {"Invalid limit": "{} is not a positive integer".format(limit)}
+            )
+        return min(int(limit), self.max_limit)
+
+    def get(self, request):
+        """Categories matching ``?q=``, most relevant first.
+
+        With ``?autocomplete=1`` only names are searched, the last word
+        matches as a prefix and results are in id order.
+        """
+        query = request.query_params.get("q", "")
+        if not search.terms(query):
+            raise ValidationError({"q": "A search query is required."})
+        autocomplete = request.query_params.get("autocomplete") in ("1", "true")
+        ids = search.search(query, autocomplete, self.get_limit())
+        return Response({"results": self.records_for_ids(ids)})
+
+
+@method_decorator(catalogue_condition("category"), name="get")
 class CategoryDetail(
     mixins.RetrieveModelMixin,
     mixins.UpdateModelMixin,
@@ -35,7 +178,11 @@ class CategoryDetail(
     serializer_class = CategorySerializer
 
     def get(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        fields = category_fields(request.query_params)
+        category = get_object_or_404(
+            self.get_queryset().only(*category_columns(fields)), pk=kwargs["pk"]
+        )
+        return Response(self.get_serializer(category, fields=fields).data)
 
     def post(self, request, *args, **kwargs):
         request.data["parent"] = kwargs["pk"]
@@ -45,56 +192,198 @@ class CategoryDetail(
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    # TODO Add patch method
     def put(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
 
+    def patch(self, request, *args, **kwargs):
+        return self.partial_update(request, *args, **kwargs)
+
     def delete(self, request, *args, **kwargs):
         return self.destroy(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        bulk.delete_subtree(instance)
+
+
+class CategoryMove(APIView):
+    def post(self, request, pk):
+        """Move a category, with its subtree, under another parent."""
+        category = get_object_or_404(Category, pk=pk)
+        serializer = CategoryMoveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        category.parent = serializer.validated_data["parent"]
+        try:
+            category.save()
+        except CycleError as e:
+            raise ValidationError({"parent": [str(e)]})
+        serializer = CategorySerializer(category, context={"request": request})
+        return Response(serializer.data)
+
+
+class CategoryBulk(APIView):
+    max_items = 10000
+
+    def get_items(self, serializer_class):
+        data = self.request.data
+        if not isinstance(data, list):
+            raise ValidationError({"Invalid batch": "Expected a list of categories"})
+        if len(data) > self.max_items:
+            raise ValidationError(
+                {"Invalid batch": "At most {} categories".format(self.max_items)}
+            )
+        serializer = serializer_class(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(BulkCategorySerializer)
+        try:
+            ids = bulk.create_categories(items)
+        except CycleError as e:
+            raise ValidationError({"Invalid batch": str(e)})
+        return Response({"ids": ids}, status=status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        items = self.get_items(BulkCategoryUpdateSerializer)
+        try:
+            categories = bulk.update_categories(items)
+        except CycleError as e:
+            raise ValidationError({"Invalid batch": str(e)})
+        categories = sorted(categories, key=lambda c: c.pk)
+        serializer = CategorySerializer(
+            categories, many=True, context={"request": request}
+        )
+        return Response(serializer.data)
+
+
+class CategoryBatch(CategoryRecordsMixin, APIView):
+    max_queries = 100
+
+    def get_queries(self):
+        data = self.request.data
+        if not isinstance(data, list):
+            raise ValidationError({"Invalid batch": "Expected a list of queries"})
+        if len(data) > self.max_queries:
+            raise ValidationError(
+                {"Invalid batch": "At most {} queries".format(self.max_queries)}
+            )
+        serializer = BatchQuerySerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def tree_queries(self, versions, pks):
+        """The categories among ``pks`` that exist, and a function returning
+        the sorted ids of a tree query about one of them.
+        """
+        if settings.CATEGORIES_TREE_CACHE:
+            snapshot = tree_cache.get_snapshot(versions["category"][0])
+            existing = {pk for pk in pks if pk in snapshot}
+            return existing, lambda pk, query_type: getattr(snapshot, query_type)(pk)
+
+        categories = Category.objects.only("path", "parent").in_bulk(pks)
+
+        def query(pk, query_type):
+            category = categories[pk]
+            if query_type == "subcategories":
+                rows = Category.objects.filter(parent_id=pk)
+            elif query_type == "siblings":
+                rows = Category.objects.filter(parent_id=category.parent_id)
+            elif query_type == "leaves":
+                rows = category.leaves()
+            else:
+                rows = category.descendants(include_self=True)
+            return list(rows.order_by("id").values_list("id", flat=True))
+
+        return set(categories), query
+
+    def post(self, request, *args, **kwargs):
+        """Answer many tree and similarity queries in one request.
+
+        The structure of every answer comes from the tree snapshot and the
+        similarity graph, then the categories of all answers are read together,
+        each once however many answers it appears in.
+        """
+        queries = self.get_queries()
+        versions = Version.snapshot(["category", "similarity"])
+        existing, tree_query = self.tree_queries(
+            versions, {query["id"] for query in queries}
+        )
+        graph = None
+        if any(query["type"] == "similar" for query in queries):
+            graph = graph_cache.get_graph(versions["similarity"][0])
+
+        answers = []
+        wanted = set()
+        for query in queries:
+            pk = query["id"]
+            if pk not in existing:
+                answers.append((query, None, None, False))
+                continue
+            distances = None
+            if query["type"] == "category":
+                ids = [pk]
+            elif query["type"] == "similar":
+                distances = {}
+                if pk in graph.index:
+                    within = graph.within(graph.index[pk], query["depth"])
+                    distances = {graph.ids[i]: d for i, d in within.items()}
+                ids = sorted(distances)
+            else:
+                ids = tree_query(pk, query["type"])
+            limit = query.get("limit", api_settings.PAGE_SIZE)
+            answers.append((query, ids[:limit], distances, len(ids) > limit))
+            wanted.update(ids[:limit])
+
+        records = self.records_for_ids(sorted(wanted))
+        records = {record["id"]: record for record in records}
+        results = []
+        for query, ids, distances, has_more in answers:
+            result = {"id": query["id"], "type": query["type"]}
+            if ids is None:
+                result["detail"] = "Not found."
+                results.append(result)
+                continue
+            found = [records[pk] for pk in ids if pk in records]
+            if distances is not None:
+                found = [
+                    {**record, "distance": distances[record["id"]]} for record in found
+                ]
+            result["results"] = found
+            result["has_more"] = has_more
+            results.append(result)
+        return Response({"results": results})
+
 
 class ImageUploadView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def put(self, request, pk):
-        image = request.data["file"]
-        category = Category.objects.get(pk=pk)
-        category.image = image
-        category.save()
+        upload = request.data.get("file")
+        category = get_object_or_404(Category, pk=pk)
+        if upload is None or not images.is_image(upload):
+            raise ValidationError({"file": "Upload a valid image."})
+        name, digest = images.store_upload(upload)
+        category.image = name
+        category.image_hash = digest
+        category.image_variants = {}
+        # Only the image fields, the rest of the category may have changed
+        # during the upload
+        category.save(update_fields=["image", "image_hash", "image_variants"])
+        transaction.on_commit(
+            lambda: images.submit(images.generate_variants, category.pk, name, digest)
+        )
         return Response(status=status.HTTP_201_CREATED)
 
 
-class CategoryTreeListing(generics.ListAPIView):
+@method_decorator(catalogue_condition("category"), name="get")
+class CategoryTreeListing(CategoryRecordsMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    query_types = ("subcategories", "siblings", "leaves", "descendants")
 
-    def get_queryset(self):
+    def check_query_type(self):
         query_type = self.kwargs["type"]
-        category = Category.objects.get(pk=self.kwargs["pk"])
-        if query_type == "subcategories":
-            return Category.objects.filter(parent__id=self.kwargs["pk"])
-        elif query_type == "siblings":
-            return Category.objects.filter(parent=category.parent)
-        elif query_type == "leaves":
-            categories_checked = [category]
-            result = []
-            while categories_checked:
-                current = categories_checked[0]
-                children = list(Category.objects.filter(parent=current))
-                if children == []:
-                    result.append(current)
-                categories_checked = categories_checked[1:] + children
-            return result
-        elif query_type == "descendants":
-            categories_checked = [category]
-            result = []
-            while categories_checked:
-                current = categories_checked[0]
-                result.append(current)
-                children = list(Category.objects.filter(parent=current))
-                categories_checked = categories_checked[1:] + children
-            return result
-        else:
+        if query_type not in self.query_types:
             raise ValidationError(
                 {
                     "Invalid search type": "{} is not a valid search type option".format(
@@ -102,10 +391,85 @@ class CategoryTreeListing(generics.ListAPIView):
                     )
                 }
             )
+        return query_type
 
+    def get_queryset(self):
+        query_type = self.check_query_type()
+        category = get_object_or_404(Category, pk=self.kwargs["pk"])
+        if query_type == "subcategories":
+            return Category.objects.filter(parent__id=self.kwargs["pk"])
+        elif query_type == "siblings":
+            return Category.objects.filter(parent=category.parent)
+        elif query_type == "leaves":
+            return category.leaves().order_by("id")
+        else:
+            return category.descendants(include_self=True).order_by("id")
+
+    def list(self, request, *args, **kwargs):
+        if not settings.CATEGORIES_TREE_CACHE:
+            return self.list_records(self.filter_queryset(self.get_queryset()))
+
+        # The structure comes from the tree snapshot
+        query_type = self.check_query_type()
+        versions = getattr(request, "catalogue_versions", None)
+        snapshot = tree_cache.get_snapshot(versions and versions["category"][0])
+        if self.kwargs["pk"] not in snapshot:
+            raise NotFound()
+        return self.list_ids(getattr(snapshot, query_type)(self.kwargs["pk"]))
+
+
+@method_decorator(catalogue_condition("category"), name="get")
+class CategorySubtree(DepthParamMixin, generics.GenericAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+    def get(self, request, *args, **kwargs):
+        category = get_object_or_404(
+            self.get_queryset().only("path", "depth"), pk=kwargs["pk"]
+        )
+        rows = category.descendants(include_self=True).order_by("id")
+        depth = self.get_depth()
+        if depth is not None:
+            rows = rows.filter(depth__lte=category.depth + depth)
+
+        # The parent is needed to nest the nodes, even when it isn't returned
+        fields = category_fields(request.query_params)
+        columns = dict.fromkeys([*category_columns(fields), "parent_id"])
+        rows = list(rows.values(*columns))
+        nodes = {}
+        for row, node in zip(rows, category_records(rows, request, fields)):
+            node["children"] = []
+            nodes[row["id"]] = node
+        for row in rows:
+            if row["id"] != category.pk:
+                nodes[row["parent_id"]]["children"].append(nodes[row["id"]])
+        return Response(nodes[category.pk])
 
+
+class SimilarityCreateMixin:
+    def create_similarity(self, data):
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        first, second = Similarity.canonical(
+            serializer.validated_data["first"].pk,
+            serializer.validated_data["second"].pk,
+        )
+        # Relies on the unique constraint, so concurrent requests for the
+        # same pair cannot both insert it
+        similarity, created = Similarity.objects.get_or_create(
+            first_id=first, second_id=second
+        )
+        if not created:
+            return Response(status=status.HTTP_208_ALREADY_REPORTED)
+        serializer = self.get_serializer(similarity)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(catalogue_condition("similarity"), name="get")
 class SimilarityList(
-    mixins.ListModelMixin, mixins.CreateModelMixin, generics.GenericAPIView
+    SimilarityCreateMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
 ):
 
     queryset = Similarity.objects.all()
@@ -115,32 +479,33 @@ class SimilarityList(
         return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        if Similarity.objects.filter(
-            first__id=request.data["first"], second__id=request.data["second"]
-        ):
-            return Response(status=status.HTTP_208_ALREADY_REPORTED)
-        if Similarity.objects.filter(
-            first__id=request.data["second"], second__id=request.data["first"]
-        ):
-            return Response(status=status.HTTP_208_ALREADY_REPORTED)
-        return self.create(request, *args, **kwargs)
+        return self.create_similarity(request.data)
 
 
+@method_decorator(catalogue_condition("category", "similarity"), name="get")
 class SimilarityDetail(
+    SimilarityCreateMixin,
+    CategoryRecordsMixin,
+    DepthParamMixin,
     generics.ListAPIView,
 ):
     queryset = Similarity.objects.all()
     serializer_class = SimilaritySerializer
 
-    def _get_similarity(self, first, second):
-        similarity = Similarity.objects.filter(
-            first__id=first, second__id=second
-        ).first()
-        if similarity is None:
-            similarity = Similarity.objects.filter(
-                first__id=second, second__id=first
-            ).first()
-        return similarity
+    def list(self, request, *args, **kwargs):
+        depth = self.get_depth()
+        if depth is None:
+            return super().list(request, *args, **kwargs)
+
+        # Categories up to depth hops away, with their distance
+        get_object_or_404(Category.objects.only("id"), pk=kwargs["pk"])
+        versions = getattr(request, "catalogue_versions", None)
+        graph = graph_cache.get_graph(versions and versions["similarity"][0])
+        if kwargs["pk"] not in graph.index:
+            return self.list_ids([])
+        distances = graph.within(graph.index[kwargs["pk"]], depth)
+        distances = {graph.ids[i]: distance for i, distance in distances.items()}
+        return self.list_ids(sorted(distances), distances)
 
     def get_queryset(self):
         category_id = self.kwargs.get("pk", None)
@@ -150,20 +515,138 @@ class SimilarityDetail(
         return similarities
 
     def post(self, request, *args, **kwargs):
-        similarity = self._get_similarity(kwargs["pk"], request.data["category"])
-        if similarity:
-            return Response(status=status.HTTP_208_ALREADY_REPORTED)
-
         data = {"first": kwargs["pk"], "second": request.data["category"]}
-        serializer = self.serializer_class(data=data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self.create_similarity(data)
 
     def patch(self, request, *args, **kwargs):
-        similarity = self._get_similarity(kwargs["pk"], request.data["category"])
-        if similarity:
-            similarity.delete()
+        deleted, _ = Similarity.between(kwargs["pk"], request.data["category"]).delete()
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_404_NOT_FOUND)
+
+
+@method_decorator(catalogue_condition("category", "similarity"), name="get")
+class SimilarityPath(CategoryRecordsMixin, generics.GenericAPIView):
+    queryset = Category.objects.all()
+
+    def get(self, request, pk, other):
+        """Shortest chain of similar categories from ``pk`` to ``other``."""
+        found = Category.objects.filter(pk__in=[pk, other]).count()
+        if found != len({pk, other}):
+            raise NotFound()
+        versions = getattr(request, "catalogue_versions", None)
+        graph = graph_cache.get_graph(versions and versions["similarity"][0])
+        path = None
+        if pk == other:
+            path = [pk]
+        elif pk in graph.index and other in graph.index:
+            path = graph.shortest_path(graph.index[pk], graph.index[other])
+            if path is not None:
+                path = [graph.ids[i] for i in path]
+        if path is None:
+            raise NotFound("The categories are not connected by similarities.")
+        return Response({"path": self.records_for_ids(path)})
+
+
+@method_decorator(catalogue_condition("category", "similarity"), name="get")
+class CategoryIsland(APIView):
+    def get(self, request, pk):
+        """The rabbit island of a category and how many categories it holds."""
+        category = get_object_or_404(Category.objects.only("island"), pk=pk)
+        if category.island is None:
+            return Response({"island": pk, "size": 1})
+        return Response(
+            {"island": category.island, "size": islands.size_of(category.island)}
+        )
+
+
+@method_decorator(catalogue_condition("similarity"), name="get")
+class IslandList(generics.ListAPIView):
+    """Rabbit islands of two or more categories, with their size."""
+
+    pagination_class = IslandCursorPagination
+
+    def get_queryset(self):
+        return (
+            Category.objects.exclude(island=None)
+            .values("island")
+            .annotate(size=Count("id"))
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(list(page))
+        return Response(list(queryset.order_by("island")))
+
+
+def export_encoding(request):
+    if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+        return "gzip"
+    return "identity"
+
+
+@method_decorator(
+    catalogue_condition("category", "similarity", encoding=export_encoding),
+    name="get",
+)
+class CatalogueExport(APIView):
+    chunk_size = 2000
+
+    def _records(self, request):
+        prefix = image_url_prefix(request)
+        categories = Category.objects.order_by("id").values_list(
+            "id", "name", "description", "image", "image_variants", "parent_id"
+        )
+        for pk, name, description, image, variants, parent in categories.iterator(
+            chunk_size=self.chunk_size
+        ):
+            yield {
+                "type": "category",
+                "id": pk,
+                "name": name,
+                "description": description,
+                "image": image_url(prefix, image),
+                "image_variants": image_variant_urls(prefix, variants),
+                "parent": parent,
+            }
+        similarities = Similarity.objects.order_by("id").values_list(
+            "first_id", "second_id"
+        )
+        for first, second in similarities.iterator(chunk_size=self.chunk_size):
+            yield {"type": "similarity", "first": first, "second": second}
+
+    def _lines(self, records):
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _array(self, records):
+        separator = "["
+        for record in records:
+            yield separator + json.dumps(record, ensure_ascii=False)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    def get(self, request):
+        layout = request.query_params.get("as", "lines")
+        if layout == "lines":
+            content_type = "application/x-ndjson"
+            content = self._lines(self._records(request))
+        elif layout == "array":
+            content_type = "application/json"
+            content = self._array(self._records(request))
+        else:
+            raise ValidationError(
+                {"Invalid layout": "{} is not a valid export layout".format(layout)}
+            )
+
+        content = (chunk.encode() for chunk in content)
+        gzip = export_encoding(request) == "gzip"
+        if gzip:
+            content = compress_sequence(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        if gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -79,9 +80,28 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections open between requests, checked before being reused
+        "CONN_MAX_AGE": int(os.environ.get("CATEGORIES_CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Run by categories.db on every new SQLite connection, in this order. Each can
+# be overridden with an environment variable, e.g. CATEGORIES_SQLITE_MMAP_SIZE.
+# In WAL mode readers don't wait for writers and writers don't wait for readers;
+# synchronous=normal is still crash safe with WAL, it may only lose the last
+# commits on power loss.
+CATEGORIES_SQLITE_PRAGMAS = {
+    name: os.environ.get("CATEGORIES_SQLITE_" + name.upper(), default)
+    for name, default in [
+        ("busy_timeout", 5000),  # milliseconds to wait for a lock
+        ("journal_mode", "wal"),
+        ("synchronous", "normal"),
+        ("cache_size", -64000),  # negative values are in KiB
+        ("mmap_size", 256 * 1024 * 1024),
+    ]
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -127,3 +147,27 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_DIR = BASE_DIR / 'media'
 MEDIA_ROOT = MEDIA_DIR
 MEDIA_URL = '/media/'
+
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "categories.pagination.IdCursorPagination",
+    "PAGE_SIZE": 100,
+    "DEFAULT_RENDERER_CLASSES": [
+        "categories.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+# Answer tree listings from an in-process snapshot of the tree structure
+CATEGORIES_TREE_CACHE = True
+# File written by "manage.py snapshot". While no category has changed since,
+# the tree cache maps it instead of reading the tree from the database.
+CATEGORIES_SNAPSHOT = None
+
+# Background threads resizing uploaded images, 0 resizes within the request
+CATEGORIES_IMAGE_WORKERS = 2
+# Longest side in pixels of each image variant, stored as JPEG and WebP
+CATEGORIES_IMAGE_SIZES = {"thumbnail": 128, "medium": 512}
+
+# Requests running one SQL statement this often are logged by
+# categories.middleware.RequestTimingMiddleware, which is off by default
+CATEGORIES_REPEATED_QUERY_THRESHOLD = 10
@@ -24,4 +24,5 @@ from django.conf.urls.static import static
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("categories.urls")),
+    path("async/", include("categories.async_urls")),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)